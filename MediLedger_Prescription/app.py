@@ -1,14 +1,76 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, session,jsonify
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from collections import Counter
 from datetime import datetime
+from itertools import groupby
+import click
+import json
+import os
+import re
+import sys
+import threading
+
+# Modules shared with the tracking app live in the repository root; appended
+# so this directory's own modules, app.py among them, still come first.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import (add_to_aggregate, configure_database, create_missing_indexes, dialect_insert,
+                      set_sqlite_pragmas)
+from instrumentation import Instrumentation
+from medicine_index import MedicineIndex
+from password_hashing import HashingOverloaded, PasswordHasher
+from streaming_export import export_response
+from upload_store import ContentAddressedStore, UploadTooLarge
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///prescription_system.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+configure_database(app, 'sqlite:///prescription_system.db')
+app.config['PRESCRIPTIONS_PER_PAGE'] = int(os.environ.get('PRESCRIPTIONS_PER_PAGE', 20))
+app.config['MAX_PRESCRIPTIONS_PER_PAGE'] = int(os.environ.get('MAX_PRESCRIPTIONS_PER_PAGE', 200))
+app.config['MAX_PRESCRIPTION_BATCH'] = int(os.environ.get('MAX_PRESCRIPTION_BATCH', 500))
+# Rows fetched per round trip by the streaming CSV/NDJSON export
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+# Medicine autocomplete: results per search and how often each process
+# rebuilds its index to pick up medicines added by other processes
+app.config['MEDICINE_SEARCH_LIMIT'] = int(os.environ.get('MEDICINE_SEARCH_LIMIT', 10))
+app.config['MAX_MEDICINE_SEARCH_LIMIT'] = int(os.environ.get('MAX_MEDICINE_SEARCH_LIMIT', 50))
+app.config['MEDICINE_INDEX_REFRESH'] = int(os.environ.get('MEDICINE_INDEX_REFRESH', 300))
+# Opt-in request instrumentation exported at /metrics; requests sent with
+# X-Profile: <PROFILE_TOKEN> are also profiled into PROFILE_DIR
+app.config['INSTRUMENTATION'] = os.environ.get('INSTRUMENTATION', '0') == '1'
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN')
+# Password hashing pool: method and cost, threads, and admission limits
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64))
+app.config['PASSWORD_HASH_MAX_WAIT_MS'] = int(os.environ.get('PASSWORD_HASH_MAX_WAIT_MS', 2000))
+# ID proofs are stored by content hash; larger request bodies are refused outright
+app.config['UPLOAD_DIR'] = os.environ.get('UPLOAD_DIR', os.path.join(app.root_path, 'uploads'))
+app.config['MAX_UPLOAD_BYTES'] = int(os.environ.get('MAX_UPLOAD_BYTES', 5 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = app.config['MAX_UPLOAD_BYTES'] + 64 * 1024
 
 db = SQLAlchemy(app)
+with app.app_context():
+    set_sqlite_pragmas(app, db.engine)
+
+password_hasher = PasswordHasher(workers=app.config['PASSWORD_HASH_WORKERS'],
+                                 method=app.config['PASSWORD_HASH_METHOD'],
+                                 max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+                                 max_wait_ms=app.config['PASSWORD_HASH_MAX_WAIT_MS'])
+upload_store = ContentAddressedStore(app.config['UPLOAD_DIR'], max_bytes=app.config['MAX_UPLOAD_BYTES'])
+
+# Instrumentation: per-route SQL and template time come from engine and
+# template events, password hashing is wrapped here
+instrumentation = None
+if app.config['INSTRUMENTATION']:
+    instrumentation = Instrumentation(app, 'prescriptions', profile_dir=app.config['PROFILE_DIR'],
+                                      profile_token=app.config['PROFILE_TOKEN'])
+    instrumentation.instrument(password_hasher, 'hash', 'password_hash')
+    instrumentation.instrument(password_hasher, 'verify', 'password_hash')
 
 # Database Models
 class Doctor(db.Model):
@@ -28,15 +90,27 @@ class Pharmacy(db.Model):
     password_hash = db.Column(db.String(200), nullable=False)
 
 class Patient(db.Model):
+    # Patients are looked up, and upserted, by name and date of birth
+    __table_args__ = (db.Index('ix_patient_name_dob', 'name', 'dob', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     dob = db.Column(db.Date, nullable=False)
 
 class Prescription(db.Model):
+    # A pharmacy reads one patient's prescriptions, newest first; reports
+    # select a patient's prescriptions or all of them by date range
+    __table_args__ = (
+        db.Index('ix_prescription_pharmacy_patient_timestamp', 'pharmacy_id', 'patient_id', 'timestamp'),
+        db.Index('ix_prescription_patient_timestamp', 'patient_id', 'timestamp'),
+        db.Index('ix_prescription_timestamp', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
     pharmacy_id = db.Column(db.Integer, db.ForeignKey('pharmacy.id'), nullable=False)
+    # Legacy "name (instructions), ..." summary; the items below are authoritative
     medicine_list = db.Column(db.String(500), nullable=False)
     dosage = db.Column(db.String(200), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -44,6 +118,7 @@ class Prescription(db.Model):
 
     # Add this relationship to the Doctor model
     doctor = db.relationship('Doctor', backref='prescriptions')
+    items = db.relationship('PrescriptionItem', back_populates='prescription', order_by='PrescriptionItem.position')
 
 class Medicine(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -52,14 +127,49 @@ class Medicine(db.Model):
     def __repr__(self):
         return f'<Medicine {self.name}>'
 
+class PrescriptionItem(db.Model):
+    # One medicine on a prescription; (medicine_id, prescription_id) answers
+    # "who was prescribed X" without touching the prescription text
+    __table_args__ = (
+        db.Index('ix_prescription_item_prescription', 'prescription_id', 'position'),
+        db.Index('ix_prescription_item_medicine', 'medicine_id', 'prescription_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    prescription_id = db.Column(db.Integer, db.ForeignKey('prescription.id'), nullable=False)
+    medicine_id = db.Column(db.Integer, db.ForeignKey('medicine.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    instructions = db.Column(db.String(200), nullable=False, default='')
+
+    prescription = db.relationship('Prescription', back_populates='items')
+    medicine = db.relationship('Medicine')
+
+# Report aggregates, kept current on every commit that adds prescriptions and
+# rebuilt from the prescription table by `flask rebuild-reports`
+class DoctorDailyCount(db.Model):
+    # Prescriptions written by a doctor per (UTC) day
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    prescriptions = db.Column(db.Integer, nullable=False)
+
+class PharmacyDailyCount(db.Model):
+    # Prescriptions sent to a pharmacy per (UTC) day
+    pharmacy_id = db.Column(db.Integer, db.ForeignKey('pharmacy.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    prescriptions = db.Column(db.Integer, nullable=False)
+
+
+# Signups and logins beyond what the hashing pool can absorb are turned away
+@app.errorhandler(HashingOverloaded)
+def hashing_overloaded(error):
+    return 'Too many sign-in attempts right now, please retry shortly.', 503, {'Retry-After': str(error.retry_after)}
+
 
 # Routes
 @app.route('/')
 def index():
     return render_template('index.html')
 
-import os
-
 @app.route('/doctor_signup', methods=['GET', 'POST'])
 def doctor_signup():
     if request.method == 'POST':
@@ -69,16 +179,14 @@ def doctor_signup():
         password = request.form['password']
         id_proof = request.files['id_proof']
 
-        hashed_password = generate_password_hash(password)
-
-        # Ensure the uploads directory exists
-        uploads_dir = os.path.join(app.root_path, 'uploads')
-        if not os.path.exists(uploads_dir):
-            os.makedirs(uploads_dir)
+        # Save the ID proof under its content hash, streamed and size-capped
+        try:
+            id_proof_path = upload_store.save(id_proof.stream, id_proof.filename)
+        except (UploadTooLarge, ValueError) as exc:
+            flash(str(exc), 'danger')
+            return redirect(url_for('doctor_signup'))
 
-        # Save the ID proof file
-        id_proof_path = os.path.join(uploads_dir, id_proof.filename)
-        id_proof.save(id_proof_path)
+        hashed_password = password_hasher.hash(password)
 
         doctor = Doctor(name=name, hospital_name=hospital_name, contact_info=contact_info, password_hash=hashed_password, id_proof=id_proof_path)
         db.session.add(doctor)
@@ -97,7 +205,7 @@ def pharmacy_signup():
         contact_info = request.form['contact_info']
         password = request.form['password']
 
-        hashed_password = generate_password_hash(password)
+        hashed_password = password_hasher.hash(password)
 
         pharmacy = Pharmacy(name=name, address=address, contact_info=contact_info, password_hash=hashed_password)
         db.session.add(pharmacy)
@@ -123,7 +231,7 @@ def login():
             flash('Invalid role!', 'danger')
             return redirect(url_for('login'))
 
-        if user and check_password_hash(user.password_hash, password):
+        if user and password_hasher.verify(user.password_hash, password):
             session['user_id'] = user.id
             session['role'] = role
             flash('Login successful!', 'success')
@@ -148,46 +256,33 @@ def doctor_dashboard():
                 flash('Invalid date format. Please enter a valid date.', 'danger')
                 return redirect(url_for('doctor_dashboard'))
 
-            medicines = request.form.getlist('medicines')
-            dosage_instructions = request.form.getlist('dosage_instructions')
+            medicine_ids = request.form.getlist('medicines', type=int)
             pharmacy_id = request.form['pharmacy']
 
-            # If new medicine is added, add it to the Medicine table
-            new_medicine = request.form.get('new_medicine')
-            if new_medicine:
-                existing_medicine = Medicine.query.filter_by(name=new_medicine).first()
-                if not existing_medicine:
-                    new_medicine_entry = Medicine(name=new_medicine)
-                    db.session.add(new_medicine_entry)
-                    db.session.commit()
+            # Everything below is one transaction: flushes hand out ids and
+            # the single commit at the end makes it all visible at once
+            try:
+                # If new medicine is added, add it to the Medicine table
+                new_medicine = request.form.get('new_medicine')
+                if new_medicine:
+                    upsert_medicine(new_medicine)
 
-            # Create the medicine list
-            medicine_list = [f"{med} ({instr})" for med, instr in zip(medicines, dosage_instructions)]
-            medicine_list_str = ", ".join(medicine_list)
+                # Each checked medicine carries its own dosage select
+                medicines = {medicine.id: medicine for medicine in Medicine.query.filter(Medicine.id.in_(medicine_ids))}
+                lines = [(medicines[medicine_id], request.form.get(f'dosage_instructions_{medicine_id}', ''))
+                         for medicine_id in medicine_ids if medicine_id in medicines]
 
-            # Find or create patient
-            patient = Patient.query.filter_by(name=patient_name, dob=patient_dob).first()
-            if not patient:
-                patient = Patient(name=patient_name, dob=patient_dob)
-                db.session.add(patient)
+                create_prescription(session['user_id'], upsert_patient(patient_name, patient_dob), pharmacy_id, lines)
                 db.session.commit()
-
-            # Create prescription
-            prescription = Prescription(
-                patient_id=patient.id,
-                doctor_id=session['user_id'],
-                pharmacy_id=pharmacy_id,
-                medicine_list=medicine_list_str,
-                dosage=""
-            )
-            db.session.add(prescription)
-            db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
 
             flash('Prescription created successfully!', 'success')
 
+        # Medicines are picked through /medicines/search rather than listed here
         pharmacies = Pharmacy.query.all()
-        medicines = Medicine.query.all()  # Get medicines from the database
-        return render_template('doctor_dashboard.html', pharmacies=pharmacies, medicines=medicines)
+        return render_template('doctor_dashboard.html', pharmacies=pharmacies)
 
     flash('Unauthorized access!', 'danger')
     return redirect(url_for('login'))
@@ -196,42 +291,571 @@ def doctor_dashboard():
 @app.route('/add_medicine', methods=['POST'])
 def add_medicine():
     # Get the medicine name from the AJAX request
-    medicine_name = request.form['medicine_name']
+    medicine_name = request.form['medicine_name'].strip()
+    if not medicine_name:
+        return jsonify({'success': False, 'message': 'Medicine name is required!'})
 
-    # Check if the medicine already exists
-    existing_medicine = Medicine.query.filter_by(name=medicine_name).first()
-    if existing_medicine:
+    # Insert unless it already exists, in one statement
+    medicine_id = insert_if_absent(Medicine, name=medicine_name)
+    if medicine_id is None:
         return jsonify({'success': False, 'message': 'Medicine already exists!'})
-
-    # Add new medicine to the database
-    new_medicine = Medicine(name=medicine_name)
-    db.session.add(new_medicine)
+    track_new_medicine(medicine_id, medicine_name)
     db.session.commit()
 
-    return jsonify({'success': True, 'message': 'Medicine added successfully!'})
+    return jsonify({'success': True, 'message': 'Medicine added successfully!', 'id': medicine_id, 'name': medicine_name})
+
+# Medicine autocomplete: /medicines/search?q=<prefix>&limit=<k>
+@app.route('/medicines/search')
+def search_medicines():
+    if 'role' not in session:
+        return jsonify({'error': 'Unauthorized access!'}), 403
+    limit = min(request.args.get('limit', app.config['MEDICINE_SEARCH_LIMIT'], type=int),
+                app.config['MAX_MEDICINE_SEARCH_LIMIT'])
+    matches = get_medicine_index().search(request.args.get('q', ''), limit)
+    return jsonify({'medicines': [{'id': medicine_id, 'name': name} for medicine_id, name in matches]})
+
+# Helper Function: The process-wide medicine prefix index
+medicine_index = MedicineIndex(refresh_interval=app.config['MEDICINE_INDEX_REFRESH'])
+medicine_index_lock = threading.Lock()
+
+def get_medicine_index():
+    """
+    Returns the medicine index, (re)building it from the database when it has
+    not been warmed yet or is older than MEDICINE_INDEX_REFRESH.
+    """
+    if medicine_index.stale():
+        with medicine_index_lock:
+            if medicine_index.stale():
+                medicine_index.warm(db.session.execute(db.select(Medicine.id, Medicine.name)).all())
+    return medicine_index
+
+def track_new_medicine(medicine_id, name):
+    # Added to the index once the transaction commits, see below
+    db.session.info.setdefault('new_medicines', []).append((medicine_id, name))
+
+@event.listens_for(db.session, 'after_commit')
+def index_committed_medicines(session):
+    for medicine_id, name in session.info.pop('new_medicines', ()):
+        medicine_index.add(medicine_id, name)
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_rolled_back_medicines(session):
+    session.info.pop('new_medicines', None)
 
 
 @app.route('/pharmacy_dashboard', methods=['GET', 'POST'])
 def pharmacy_dashboard():
     if 'role' in session and session['role'] == 'pharmacy':
         prescriptions = None
-        if request.method == 'POST':
-            patient_name = request.form['patient_name']
-            patient_dob = request.form['patient_dob']
+        next_page = None
+        # The search is posted from the form; further pages are plain GET links
+        search = request.form if request.method == 'POST' else request.args
+        patient_name = search.get('patient_name')
+        patient_dob_str = search.get('patient_dob')
+        if patient_name and patient_dob_str:
+            try:
+                patient_dob = datetime.strptime(patient_dob_str, "%Y-%m-%d").date()
+            except ValueError:
+                flash('Invalid date format. Please enter a valid date.', 'danger')
+                return redirect(url_for('pharmacy_dashboard'))
 
             patient = Patient.query.filter_by(name=patient_name, dob=patient_dob).first()
             if patient:
-                # Order prescriptions by timestamp in descending order (newest to oldest)
-                prescriptions = Prescription.query.filter_by(patient_id=patient.id, pharmacy_id=session['user_id']).order_by(Prescription.timestamp.desc()).all()
+                prescriptions, next_page = prescription_page(patient.id, session['user_id'])
+                if next_page:
+                    next_page = url_for('pharmacy_dashboard', patient_name=patient_name,
+                                        patient_dob=patient_dob_str, **next_page)
 
-        return render_template('pharmacy_dashboard.html', prescriptions=prescriptions)
+        return render_template('pharmacy_dashboard.html', prescriptions=prescriptions, next_page=next_page)
 
     flash('Unauthorized access!', 'danger')
     return redirect(url_for('login'))
 
+# Helper Function: One page of a patient's prescriptions at a pharmacy
+def prescription_page(patient_id, pharmacy_id):
+    """
+    Keyset-paginated, newest first, with the prescribing doctor joined in.
+    The cursor is the (timestamp, id) of the last prescription on the
+    previous page, read from the before_ts / before_id query arguments.
+    :return: (prescriptions, cursor arguments for the next page or None)
+    """
+    limit = app.config['PRESCRIPTIONS_PER_PAGE']
+    query = (Prescription.query
+             .options(joinedload(Prescription.doctor),
+                      selectinload(Prescription.items).joinedload(PrescriptionItem.medicine))
+             .filter_by(pharmacy_id=pharmacy_id, patient_id=patient_id)
+             .order_by(Prescription.timestamp.desc(), Prescription.id.desc()))
+
+    before_ts = request.args.get('before_ts')
+    before_id = request.args.get('before_id', type=int)
+    if before_ts and before_id is not None:
+        try:
+            before_ts = datetime.fromisoformat(before_ts)
+        except ValueError:
+            # A mangled page link falls back to the newest prescriptions
+            flash('Invalid page link, showing the newest prescriptions.', 'danger')
+            before_ts = None
+    if before_ts and before_id is not None:
+        query = query.filter(db.or_(Prescription.timestamp < before_ts,
+                                    db.and_(Prescription.timestamp == before_ts, Prescription.id < before_id)))
+
+    prescriptions = query.limit(limit + 1).all()
+    if len(prescriptions) <= limit:
+        return prescriptions, None
+    prescriptions = prescriptions[:limit]
+    last = prescriptions[-1]
+    return prescriptions, {'before_ts': last.timestamp.isoformat(), 'before_id': last.id}
+
+
+# Helper Function: Upsert a row by its unique columns
+def upsert(model, **values):
+    """
+    Inserts the row unless one with the same unique values exists, in one
+    INSERT ... ON CONFLICT statement, so concurrent requests cannot both
+    create it. Runs in the current transaction and does not commit.
+    :param values: Values of the model's unique key, which is also the conflict target
+    :return: Id of the new or existing row
+    """
+    statement = dialect_insert(db, model)
+    if statement is None:
+        row_id = insert_if_absent(model, **values)
+        if row_id is None:
+            row_id = db.session.execute(db.select(model.id).filter_by(**values)).scalar_one()
+        return row_id
+
+    statement = statement.values(**values)
+    # The no-op update makes RETURNING yield the id of an existing row too
+    statement = statement.on_conflict_do_update(index_elements=list(values),
+                                                set_={column: statement.excluded[column] for column in values})
+    return db.session.execute(statement.returning(model.id)).scalar_one()
+
+def insert_if_absent(model, **values):
+    """
+    Like upsert(), but tells the caller whether the row was new.
+    :return: Id of the new row, or None if it already existed
+    """
+    statement = dialect_insert(db, model)
+    if statement is None:
+        # No ON CONFLICT on this database: let the unique index reject it inside a savepoint
+        try:
+            with db.session.begin_nested():
+                return db.session.execute(db.insert(model).values(**values)).inserted_primary_key[0]
+        except IntegrityError:
+            return None
+    statement = statement.values(**values).on_conflict_do_nothing(index_elements=list(values))
+    return db.session.execute(statement.returning(model.id)).scalar()
+
+def upsert_patient(name, dob):
+    return upsert(Patient, name=name, dob=dob)
+
+def upsert_medicine(name):
+    medicine_id = insert_if_absent(Medicine, name=name)
+    if medicine_id is None:
+        return db.session.execute(db.select(Medicine.id).filter_by(name=name)).scalar_one()
+    track_new_medicine(medicine_id, name)
+    return medicine_id
+
+# Helper Function: Add a prescription and its line items
+def create_prescription(doctor_id, patient_id, pharmacy_id, lines):
+    """
+    Adds the prescription and flushes it for its id; the caller commits.
+    :param lines: List of (Medicine, instructions) in prescribed order
+    :return: Prescription
+    """
+    prescription = Prescription(
+        patient_id=patient_id,
+        doctor_id=doctor_id,
+        pharmacy_id=pharmacy_id,
+        medicine_list=", ".join(f"{medicine.name} ({instructions})" for medicine, instructions in lines),
+        dosage=""
+    )
+    db.session.add(prescription)
+    db.session.flush()
+    add_prescription_items(prescription.id, lines)
+    count_prescription(prescription)
+    return prescription
+
+# Prescriptions added in the current transaction are counted in session.info
+# and folded into the daily aggregates just before it commits, one upsert per
+# (doctor or pharmacy, day) however many prescriptions a batch holds.
+def count_prescription(prescription):
+    counts = db.session.info.setdefault('prescription_counts', Counter())
+    day = prescription.timestamp.date()
+    counts[DoctorDailyCount, 'doctor_id', int(prescription.doctor_id), day] += 1
+    counts[PharmacyDailyCount, 'pharmacy_id', int(prescription.pharmacy_id), day] += 1
+
+@event.listens_for(db.session, 'before_commit')
+def write_prescription_counts(session):
+    for (model, column, owner_id, day), prescriptions in session.info.pop('prescription_counts', {}).items():
+        add_to_aggregate(db, model, {column: owner_id, 'day': day}, sums={'prescriptions': prescriptions})
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_prescription_counts(session):
+    session.info.pop('prescription_counts', None)
+
+def rebuild_report_aggregates():
+    """
+    Recomputes the daily aggregates from the prescription table with one
+    INSERT ... SELECT ... GROUP BY per table, in one transaction.
+    :return: Dictionary with the number of rows written per table
+    """
+    report = {}
+    for model, column in ((DoctorDailyCount, 'doctor_id'), (PharmacyDailyCount, 'pharmacy_id')):
+        owner = getattr(Prescription, column)
+        day = db.func.date(Prescription.timestamp)
+        db.session.execute(db.delete(model))
+        report[model.__tablename__] = db.session.execute(db.insert(model).from_select(
+            [column, 'day', 'prescriptions'],
+            db.select(owner, day, db.func.count()).group_by(owner, day))).rowcount
+    # The counts were taken from the table itself; nothing pending may be added on top
+    db.session.info.pop('prescription_counts', None)
+    db.session.commit()
+    return report
+
+# Helper Function: Write a prescription's line items
+def add_prescription_items(prescription_id, lines):
+    """
+    Inserts all items of one prescription with a single executemany.
+    :param prescription_id: Id of the (flushed) prescription
+    :param lines: List of (Medicine, instructions) in prescribed order
+    """
+    if lines:
+        db.session.execute(db.insert(PrescriptionItem), [
+            {'prescription_id': prescription_id, 'medicine_id': medicine.id, 'position': position,
+             'instructions': instructions}
+            for position, (medicine, instructions) in enumerate(lines)
+        ])
+
+# Helper Function: Filtered prescription query
+def search_prescriptions(medicine_id=None, patient_id=None, start=None, end=None, pharmacy_id=None):
+    """
+    Prescriptions newest first, narrowed by any of the filters. Each filter is
+    served by an index: medicine through prescription_item, patient through
+    (patient_id, timestamp) and a bare date range through timestamp.
+    :param start: (Optional) Earliest timestamp, inclusive
+    :param end: (Optional) Latest timestamp, exclusive
+    :return: Query
+    """
+    query = Prescription.query
+    if medicine_id is not None:
+        query = query.filter(Prescription.id.in_(
+            db.select(PrescriptionItem.prescription_id).where(PrescriptionItem.medicine_id == medicine_id)))
+    if patient_id is not None:
+        query = query.filter(Prescription.patient_id == patient_id)
+    if pharmacy_id is not None:
+        query = query.filter(Prescription.pharmacy_id == pharmacy_id)
+    if start is not None:
+        query = query.filter(Prescription.timestamp >= start)
+    if end is not None:
+        query = query.filter(Prescription.timestamp < end)
+    return query.order_by(Prescription.timestamp.desc(), Prescription.id.desc())
+
+def prescription_to_dict(prescription):
+    return {
+        'id': prescription.id,
+        'patient_id': prescription.patient_id,
+        'doctor_id': prescription.doctor_id,
+        'pharmacy_id': prescription.pharmacy_id,
+        'timestamp': prescription.timestamp.isoformat(),
+        'fulfilled': prescription.fulfilled,
+        'items': [{'medicine_id': item.medicine_id, 'medicine': item.medicine.name, 'instructions': item.instructions}
+                  for item in prescription.items],
+    }
+
+# Prescription search API: ?medicine_id=&patient_id=&from=&to=&limit=, paged with before_ts/before_id
+@app.route('/api/prescriptions')
+def api_prescriptions():
+    if session.get('role') not in ('doctor', 'pharmacy'):
+        return jsonify({'error': 'Unauthorized access!'}), 403
+    try:
+        start = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+        before_ts = datetime.fromisoformat(request.args['before_ts']) if request.args.get('before_ts') else None
+    except ValueError:
+        return jsonify({'error': 'Dates must be ISO 8601'}), 400
+    limit = max(1, min(request.args.get('limit', app.config['PRESCRIPTIONS_PER_PAGE'], type=int),
+                       app.config['MAX_PRESCRIPTIONS_PER_PAGE']))
+
+    # A pharmacy only sees prescriptions sent to it
+    query = search_prescriptions(medicine_id=request.args.get('medicine_id', type=int),
+                                 patient_id=request.args.get('patient_id', type=int),
+                                 start=start, end=end,
+                                 pharmacy_id=session['user_id'] if session['role'] == 'pharmacy' else None)
+    before_id = request.args.get('before_id', type=int)
+    if before_ts is not None and before_id is not None:
+        query = query.filter(db.or_(Prescription.timestamp < before_ts,
+                                    db.and_(Prescription.timestamp == before_ts, Prescription.id < before_id)))
+    prescriptions = (query.options(selectinload(Prescription.items).joinedload(PrescriptionItem.medicine))
+                     .limit(limit + 1).all())
+
+    next_cursor = None
+    if len(prescriptions) > limit:
+        prescriptions = prescriptions[:limit]
+        last = prescriptions[-1]
+        next_cursor = {'before_ts': last.timestamp.isoformat(), 'before_id': last.id}
+    return jsonify({
+        'prescriptions': [prescription_to_dict(prescription) for prescription in prescriptions],
+        'next_cursor': next_cursor,
+    })
+
+
+# Daily prescription counts of the signed-in doctor or pharmacy: ?from=&to= (dates, inclusive)
+@app.route('/api/reports/daily')
+def api_reports_daily():
+    if session.get('role') not in ('doctor', 'pharmacy'):
+        return jsonify({'error': 'Unauthorized access!'}), 403
+    try:
+        start = datetime.strptime(request.args['from'], "%Y-%m-%d").date() if request.args.get('from') else None
+        end = datetime.strptime(request.args['to'], "%Y-%m-%d").date() if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    model, owner = ((DoctorDailyCount, DoctorDailyCount.doctor_id) if session['role'] == 'doctor'
+                    else (PharmacyDailyCount, PharmacyDailyCount.pharmacy_id))
+    query = db.select(model.day, model.prescriptions).where(owner == session['user_id']).order_by(model.day)
+    if start is not None:
+        query = query.where(model.day >= start)
+    if end is not None:
+        query = query.where(model.day <= end)
+    return jsonify({'days': [{'day': day.isoformat(), 'prescriptions': prescriptions}
+                             for day, prescriptions in db.session.execute(query)]})
+
+
+# Streaming export of the prescriptions /api/prescriptions would return, in id
+# order and resumable with ?after=<last id>. Rows are read through a
+# server-side cursor and encoded as the response is sent.
+@app.route('/api/prescriptions/export.<any(csv, ndjson):fmt>')
+def api_prescriptions_export(fmt):
+    if session.get('role') not in ('doctor', 'pharmacy'):
+        return jsonify({'error': 'Unauthorized access!'}), 403
+    try:
+        start = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'Dates must be ISO 8601'}), 400
+    query = search_prescriptions(medicine_id=request.args.get('medicine_id', type=int),
+                                 patient_id=request.args.get('patient_id', type=int),
+                                 start=start, end=end,
+                                 pharmacy_id=session['user_id'] if session['role'] == 'pharmacy' else None)
+    after = request.args.get('after', type=int)
+    if after is not None:
+        query = query.filter(Prescription.id > after)
+    # One row per line item, consecutive for each prescription
+    rows = (query.order_by(None)
+            .outerjoin(PrescriptionItem, PrescriptionItem.prescription_id == Prescription.id)
+            .outerjoin(Medicine, PrescriptionItem.medicine_id == Medicine.id)
+            .with_entities(Prescription.id, Prescription.patient_id, Prescription.doctor_id, Prescription.pharmacy_id,
+                           Prescription.timestamp, Prescription.fulfilled, Medicine.name, PrescriptionItem.instructions)
+            .order_by(Prescription.id, PrescriptionItem.position)
+            .yield_per(app.config['EXPORT_BATCH_SIZE']))
+
+    def prescriptions():
+        for _, items in groupby(rows, key=lambda row: row.id):
+            first = next(items)
+            medicines = [(row.name, row.instructions) for row in (first, *items) if row.name is not None]
+            if fmt == 'csv':
+                medicines = '; '.join(f'{name} ({instructions})' for name, instructions in medicines)
+            else:
+                medicines = [{'medicine': name, 'instructions': instructions} for name, instructions in medicines]
+            yield (*first[:6], medicines)
+
+    return export_response(['id', 'patient_id', 'doctor_id', 'pharmacy_id', 'timestamp', 'fulfilled', 'items'],
+                           prescriptions(), fmt, 'prescriptions')
+
+
+# Batch prescription API: many prescriptions in one request and one transaction.
+# Body: {"prescriptions": [{"patient_name", "patient_dob", "pharmacy_id",
+#        "items": [{"medicine" or "medicine_id", "instructions"}]}]}
+@app.route('/api/prescriptions/batch', methods=['POST'])
+def api_prescriptions_batch():
+    if session.get('role') != 'doctor':
+        return jsonify({'error': 'Unauthorized access!'}), 403
+    entries = (request.get_json(silent=True) or {}).get('prescriptions')
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'error': 'Expected a non-empty "prescriptions" list'}), 400
+    if len(entries) > app.config['MAX_PRESCRIPTION_BATCH']:
+        return jsonify({'error': f"At most {app.config['MAX_PRESCRIPTION_BATCH']} prescriptions per batch"}), 413
+
+    # Validate the whole batch before writing any of it
+    try:
+        parsed = [parse_batch_entry(entry) for entry in entries]
+    except (KeyError, TypeError, ValueError) as exc:
+        return jsonify({'error': f'Invalid prescription: {exc}'}), 400
+    medicine_ids = {medicine_id for *_, items in parsed for medicine_id, _, _ in items if medicine_id is not None}
+    medicines = {medicine.id: medicine for medicine in Medicine.query.filter(Medicine.id.in_(medicine_ids))}
+    if medicine_ids - medicines.keys():
+        return jsonify({'error': f'Unknown medicine ids: {sorted(medicine_ids - medicines.keys())}'}), 400
+
+    try:
+        patients = {}
+        created = []
+        for patient_name, patient_dob, pharmacy_id, items in parsed:
+            if (patient_name, patient_dob) not in patients:
+                patients[patient_name, patient_dob] = upsert_patient(patient_name, patient_dob)
+            lines = []
+            for medicine_id, medicine_name, instructions in items:
+                if medicine_id is None:
+                    medicine_id = upsert_medicine(medicine_name)
+                    medicines.setdefault(medicine_id, db.session.get(Medicine, medicine_id))
+                lines.append((medicines[medicine_id], instructions))
+            created.append(create_prescription(session['user_id'], patients[patient_name, patient_dob], pharmacy_id, lines))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return jsonify({'prescription_ids': [prescription.id for prescription in created]}), 201
+
+# Helper Function: Check and normalize one entry of a prescription batch
+def parse_batch_entry(entry):
+    """
+    :param entry: One element of the batch's "prescriptions" list
+    :return: (patient_name, patient_dob, pharmacy_id, items) with items as
+             (medicine_id or None, medicine name or None, instructions)
+    :raises ValueError: If the entry or any of its items is malformed
+    """
+    if not isinstance(entry, dict):
+        raise ValueError('each prescription must be an object')
+    patient_name = entry.get('patient_name')
+    if not isinstance(patient_name, str) or not patient_name.strip():
+        raise ValueError('"patient_name" must be a non-empty string')
+    if not isinstance(entry.get('patient_dob'), str):
+        raise ValueError('"patient_dob" must be a YYYY-MM-DD string')
+    patient_dob = datetime.strptime(entry['patient_dob'], "%Y-%m-%d").date()
+    pharmacy_id = entry.get('pharmacy_id')
+    if isinstance(pharmacy_id, str) and pharmacy_id.isdigit():
+        pharmacy_id = int(pharmacy_id)
+    if not isinstance(pharmacy_id, int) or isinstance(pharmacy_id, bool):
+        raise ValueError('"pharmacy_id" must be an integer')
+    items = entry.get('items') or []
+    if not isinstance(items, list):
+        raise ValueError('"items" must be a list')
+
+    parsed_items = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('each item must be an object')
+        instructions = item.get('instructions', '')
+        if not isinstance(instructions, str):
+            raise ValueError('"instructions" must be a string')
+        if 'medicine_id' in item:
+            if not isinstance(item['medicine_id'], int) or isinstance(item['medicine_id'], bool):
+                raise ValueError('"medicine_id" must be an integer')
+            parsed_items.append((item['medicine_id'], None, instructions))
+        elif isinstance(item.get('medicine'), str) and item['medicine'].strip():
+            parsed_items.append((None, item['medicine'].strip(), instructions))
+        else:
+            raise ValueError('each item needs an integer "medicine_id" or a "medicine" name')
+    return patient_name, patient_dob, pharmacy_id, parsed_items
+
+# Legacy medicine_list entries look like "Name (instructions)"
+LEGACY_ITEM = re.compile(r'(.+?) \(([^()]*)\)(?:, |$)')
+
+def parse_medicine_list(medicine_list):
+    """
+    Splits a legacy medicine_list string into (name, instructions) pairs.
+    Entries without instructions are kept with empty instructions.
+    """
+    items = []
+    position = 0
+    for match in LEGACY_ITEM.finditer(medicine_list):
+        # Anything skipped over before this match had no "(instructions)"
+        for name in medicine_list[position:match.start()].split(', '):
+            if name.strip():
+                items.append((name.strip(), ''))
+        items.append((match.group(1).strip(), match.group(2).strip()))
+        position = match.end()
+    for name in medicine_list[position:].split(', '):
+        if name.strip():
+            items.append((name.strip(), ''))
+    return items
+
+def backfill_prescription_items(batch_size=1000):
+    """
+    Creates PrescriptionItem rows for prescriptions that only have the legacy
+    medicine_list text. Walks the table in id order one batch at a time and
+    commits per batch, so it can be interrupted and rerun.
+    :return: Dictionary with the number of prescriptions and items written
+    """
+    medicine_ids = dict(db.session.execute(db.select(Medicine.name, Medicine.id)).all())
+    report = {'prescriptions': 0, 'items': 0, 'medicines_created': 0}
+    last_id = 0
+    while True:
+        batch = db.session.execute(
+            db.select(Prescription.id, Prescription.medicine_list)
+            .where(Prescription.id > last_id)
+            .where(~db.exists().where(PrescriptionItem.prescription_id == Prescription.id))
+            .order_by(Prescription.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return report
+
+        rows = []
+        for prescription_id, medicine_list in batch:
+            for position, (name, instructions) in enumerate(parse_medicine_list(medicine_list)):
+                if name not in medicine_ids:
+                    medicine_ids[name] = upsert_medicine(name)
+                    report['medicines_created'] += 1
+                rows.append({'prescription_id': prescription_id, 'medicine_id': medicine_ids[name],
+                             'position': position, 'instructions': instructions})
+        if rows:
+            db.session.execute(db.insert(PrescriptionItem), rows)
+        db.session.commit()
+        report['prescriptions'] += len(batch)
+        report['items'] += len(rows)
+        last_id = batch[-1][0]
+
+@app.cli.command('rebuild-reports')
+def rebuild_reports_command():
+    """Recompute the daily prescription counts from the prescription table."""
+    db.create_all()
+    click.echo(json.dumps(rebuild_report_aggregates(), indent=2))
+
+@app.cli.command('backfill-prescription-items')
+@click.option('--batch-size', default=1000, show_default=True, help='Prescriptions per transaction')
+def backfill_prescription_items_command(batch_size):
+    """Create line items for prescriptions stored before they existed."""
+    db.create_all()
+    ensure_indexes()
+    click.echo(json.dumps(backfill_prescription_items(batch_size), indent=2))
+
+
+# Brings the indexes of an existing database up to date with the models
+def ensure_indexes():
+    make_patient_index_unique()
+    create_missing_indexes(db)
+
+def make_patient_index_unique():
+    """
+    Databases created before patients were upserted have a non-unique
+    (name, dob) index, or none at all, and possibly duplicate patients.
+    Merges duplicates into the oldest row and drops a non-unique index, so
+    the unique one can be created.
+    """
+    existing = {index['name']: index for index in inspect(db.engine).get_indexes('patient')}
+    index = existing.get('ix_patient_name_dob')
+    if index is not None and index['unique']:
+        return
+    with db.engine.begin() as connection:
+        duplicates = connection.execute(db.text(
+            'SELECT p.id, keep.id FROM patient p JOIN '
+            '(SELECT name, dob, MIN(id) AS id FROM patient GROUP BY name, dob HAVING COUNT(*) > 1) keep '
+            'ON p.name = keep.name AND p.dob = keep.dob AND p.id <> keep.id')).all()
+        for duplicate_id, keep_id in duplicates:
+            connection.execute(db.update(Prescription).where(Prescription.patient_id == duplicate_id)
+                               .values(patient_id=keep_id))
+            connection.execute(db.delete(Patient).where(Patient.id == duplicate_id))
+        if index is not None:
+            connection.execute(db.text('DROP INDEX ix_patient_name_dob'))
+
+# Runs on import, so every server (flask run, WSGI) gets the tables and the
+# unique (name, dob) index upsert_patient's ON CONFLICT relies on
+with app.app_context():
+    db.create_all()
+    ensure_indexes()
 
 
 if __name__ == "__main__":
     with app.app_context():
-        db.create_all()  # Ensure tables are created
+        get_medicine_index()  # Warm the autocomplete index before the first request
     app.run(debug=True)
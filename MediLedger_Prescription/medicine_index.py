@@ -0,0 +1,111 @@
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from time import monotonic
+
+
+def normalize(text):
+    """
+    Search key for a medicine name: accents stripped, case folded and
+    whitespace collapsed, so "Ibuprofène  200MG" matches "ibuprofene 200mg".
+    """
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(character for character in decomposed if not unicodedata.combining(character))
+    return ' '.join(stripped.casefold().split())
+
+
+class MedicineIndex:
+    """
+    In-process prefix index over medicine names for autocomplete.
+
+    Normalized names live in one sorted array and the later words of each
+    name in a second one, so "clav" finds "Amoxicillin Clavulanate" after the
+    names that start with it. A search is a bisect into each array followed by
+    a scan of at most the results it returns, which keeps lookups well under a
+    millisecond at 100k+ names. Additions are applied in place; warm()
+    rebuilds from the database.
+    """
+
+    def __init__(self, refresh_interval=None):
+        """
+        :param refresh_interval: (Optional) Seconds after which stale() reports
+                                 the index should be rebuilt, so additions made
+                                 by other processes show up
+        """
+        self.refresh_interval = refresh_interval
+        self._names = {}     # id -> name
+        self._prefixes = []  # sorted (normalized name, name, id)
+        self._words = []     # sorted (normalized name from its second word on, name, id)
+        self._lock = threading.Lock()
+        self.warmed_at = None
+        self.searches = 0
+
+    def warm(self, medicines):
+        """
+        Replaces the index contents.
+        :param medicines: Iterable of (id, name)
+        """
+        names = dict(medicines)
+        prefixes = []
+        words = []
+        for medicine_id, name in names.items():
+            whole, *rest = self._keys_for(medicine_id, name)
+            prefixes.append(whole)
+            words.extend(rest)
+        prefixes.sort()
+        words.sort()
+        with self._lock:
+            self._names = names
+            self._prefixes = prefixes
+            self._words = words
+            self.warmed_at = monotonic()
+
+    def stale(self):
+        if self.warmed_at is None:
+            return True
+        return self.refresh_interval is not None and monotonic() - self.warmed_at > self.refresh_interval
+
+    def add(self, medicine_id, name):
+        with self._lock:
+            if medicine_id in self._names:
+                return
+            self._names[medicine_id] = name
+            whole, *rest = self._keys_for(medicine_id, name)
+            insort(self._prefixes, whole)
+            for key in rest:
+                insort(self._words, key)
+
+    @staticmethod
+    def _keys_for(medicine_id, name):
+        words = normalize(name).split(' ')
+        return [(' '.join(words[start:]), name, medicine_id) for start in range(len(words))]
+
+    def search(self, query, limit=10):
+        """
+        :param query: Prefix typed by the user, matched against the start of any word
+        :param limit: Maximum number of results
+        :return: List of (id, name); names starting with the prefix first,
+                 then names with a later word starting with it, each group in
+                 alphabetical order
+        """
+        prefix = normalize(query)
+        if not prefix or limit <= 0:
+            return []
+        results = []
+        seen = set()
+        with self._lock:
+            self.searches += 1
+            for keys in (self._prefixes, self._words):
+                position = bisect_left(keys, (prefix,))
+                while position < len(keys) and len(results) < limit:
+                    key, name, medicine_id = keys[position]
+                    if not key.startswith(prefix):
+                        break
+                    if medicine_id not in seen:
+                        seen.add(medicine_id)
+                        results.append((medicine_id, name))
+                    position += 1
+        return results
+
+    def __len__(self):
+        return len(self._names)
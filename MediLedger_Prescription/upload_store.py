@@ -0,0 +1,87 @@
+import hashlib
+import os
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class ContentAddressedStore:
+    """
+    Stores uploaded files under the SHA-256 of their content.
+
+    save() copies the upload in fixed-size chunks into a temporary file in
+    the store, hashing and counting bytes as it goes, so no upload is ever
+    held in memory and oversized ones are abandoned as soon as they cross the
+    cap. The finished file is renamed to <root>/<hash[:2]>/<hash><ext>; an
+    identical upload finds the file already there and is dropped, so each
+    distinct content is kept once. The client's file name is only used for
+    its extension.
+    """
+
+    def __init__(self, root, max_bytes=5 * 1024 * 1024, extensions=('.pdf', '.jpg', '.jpeg', '.png')):
+        """
+        :param root: Directory holding the stored files
+        :param max_bytes: Largest accepted upload
+        :param extensions: Accepted file name extensions, lower case
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.extensions = extensions
+
+    def extension(self, filename):
+        """
+        :return: Normalized extension of filename, or None if it is not accepted
+        """
+        extension = os.path.splitext(filename or '')[1].lower()
+        if extension in self.extensions:
+            return extension
+        return None
+
+    def save(self, stream, filename):
+        """
+        :param stream: Readable binary stream of the upload
+        :param filename: Name the client sent, used for its extension only
+        :return: Path of the stored file relative to the store root
+        :raises UploadTooLarge: The upload exceeds max_bytes
+        :raises ValueError: The extension is not accepted
+        """
+        extension = self.extension(filename)
+        if extension is None:
+            raise ValueError(f'Unsupported file type, expected one of {", ".join(self.extensions)}')
+
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.root, suffix='.upload')
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLarge(f'Upload exceeds {self.max_bytes} bytes')
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            key = digest.hexdigest()
+            relative_path = os.path.join(key[:2], key + extension)
+            path = os.path.join(self.root, relative_path)
+            if os.path.exists(path):
+                os.remove(temporary_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temporary_path, path)
+            return relative_path
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+    def path(self, relative_path):
+        return os.path.join(self.root, relative_path)
@@ -1,22 +1,104 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, abort
+from flask import Flask, render_template, request, redirect, url_for, flash, abort, jsonify, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-import qrcode
+import atexit
+import click
+import csv
+import hashlib
+import io
+import json
 import os
+import threading
 import uuid
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from time import perf_counter, sleep
+from sqlalchemy import event
+from sqlalchemy.orm import selectinload
+
+from blockchain import Blockchain
+from chain_indexer import ChainIndexer, JsonRpcClient, SqlChainStore
+from database import add_to_aggregate, configure_database, create_missing_indexes, set_sqlite_pragmas
+from identity_cache import IdentityCache
+from instrumentation import Instrumentation
+from live_updates import LiveUpdates, LocalBroker, RedisBroker
+from mempool import Mempool
+from password_hashing import HashingOverloaded, PasswordHasher
+from qr_service import MIMETYPES, QRCodeRenderer
+from response_cache import LRUCacheBackend, RedisCacheBackend, ResponseCache
+from streaming_export import export_response
 
 # Initialize Flask App
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///medical_tracking.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+configure_database(app, 'sqlite:///medical_tracking.db')
+app.config['LEDGER_PATH'] = os.environ.get('LEDGER_PATH', os.path.join(app.instance_path, 'ledger'))
+app.config['LEDGER_DIFFICULTY'] = int(os.environ.get('LEDGER_DIFFICULTY', 4))
+app.config['LEDGER_BLOCK_SIZE'] = int(os.environ.get('LEDGER_BLOCK_SIZE', 100))
+app.config['LEDGER_BLOCK_INTERVAL_MS'] = int(os.environ.get('LEDGER_BLOCK_INTERVAL_MS', 1000))
+app.config['PRODUCTS_PER_PAGE'] = int(os.environ.get('PRODUCTS_PER_PAGE', 50))
+app.config['MAX_PRODUCTS_PER_PAGE'] = 200
+# Rows fetched per round trip by the streaming CSV/NDJSON exports
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+app.config['QR_WORKERS'] = int(os.environ.get('QR_WORKERS', os.cpu_count()))
+# Base URL encoded in QR codes; defaults to the host the image is requested from,
+# in which case images are only cacheable by the browser (the Host header is
+# client-supplied, so a shared cache must not keep them)
+app.config['QR_BASE_URL'] = os.environ.get('QR_BASE_URL')
+app.config['QR_CACHE_SIZE'] = int(os.environ.get('QR_CACHE_SIZE', 1024))
+app.config['QR_CACHE_DIR'] = os.environ.get('QR_CACHE_DIR')
+app.config['QR_MAX_AGE'] = int(os.environ.get('QR_MAX_AGE', 86400))
+# Rendered /track pages: 'memory' (per process) or 'redis' (shared, needs TRACK_CACHE_URL)
+app.config['TRACK_CACHE_BACKEND'] = os.environ.get('TRACK_CACHE_BACKEND', 'memory')
+app.config['TRACK_CACHE_URL'] = os.environ.get('TRACK_CACHE_URL', 'redis://localhost:6379/0')
+app.config['TRACK_CACHE_SIZE'] = int(os.environ.get('TRACK_CACHE_SIZE', 4096))
+app.config['TRACK_CACHE_TTL'] = int(os.environ.get('TRACK_CACHE_TTL', 300))
+# Logged-in users are loaded from a per-process cache; the TTL bounds how long
+# a change made by another process can go unnoticed
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1024))
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))
+# Tracking.sol event index: JSON-RPC endpoint, contract and how logs are fetched
+app.config['CHAIN_RPC_URL'] = os.environ.get('CHAIN_RPC_URL', 'http://127.0.0.1:8545')
+app.config['CHAIN_CONTRACT_ADDRESS'] = os.environ.get('CHAIN_CONTRACT_ADDRESS')
+app.config['CHAIN_START_BLOCK'] = int(os.environ.get('CHAIN_START_BLOCK', 0))
+app.config['CHAIN_BATCH_BLOCKS'] = int(os.environ.get('CHAIN_BATCH_BLOCKS', 2000))
+app.config['CHAIN_REORG_DEPTH'] = int(os.environ.get('CHAIN_REORG_DEPTH', 12))
+app.config['CHAIN_CONFIRMATIONS'] = int(os.environ.get('CHAIN_CONFIRMATIONS', 0))
+# Opt-in live tracking updates: server-sent events from an asyncio server on
+# its own, publicly reachable port. LIVE_UPDATES_URL is the address browsers
+# use for it (e.g. behind a reverse proxy) and defaults to the page's host on
+# LIVE_UPDATES_PORT. The server is started by `python app.py`; other WSGI
+# servers call start_live_updates() in each worker, e.g. from gunicorn's
+# post_fork hook. With several worker processes, set LIVE_UPDATES_REDIS_URL
+# so updates reach all of them.
+app.config['LIVE_UPDATES'] = os.environ.get('LIVE_UPDATES', '0') == '1'
+app.config['LIVE_UPDATES_HOST'] = os.environ.get('LIVE_UPDATES_HOST', '0.0.0.0')
+app.config['LIVE_UPDATES_PORT'] = int(os.environ.get('LIVE_UPDATES_PORT', 8081))
+app.config['LIVE_UPDATES_URL'] = os.environ.get('LIVE_UPDATES_URL')
+app.config['LIVE_UPDATES_REDIS_URL'] = os.environ.get('LIVE_UPDATES_REDIS_URL')
+app.config['LIVE_UPDATES_TOKEN_MAX_AGE'] = int(os.environ.get('LIVE_UPDATES_TOKEN_MAX_AGE', 12 * 3600))
+# Opt-in request instrumentation exported at /metrics; requests sent with
+# X-Profile: <PROFILE_TOKEN> are also profiled into PROFILE_DIR
+app.config['INSTRUMENTATION'] = os.environ.get('INSTRUMENTATION', '0') == '1'
+app.config['INSTRUMENTATION_SAMPLE_RATE'] = float(os.environ.get('INSTRUMENTATION_SAMPLE_RATE', 0.1))
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN')
+# Password hashing pool: method and cost, threads, and admission limits
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64))
+app.config['PASSWORD_HASH_MAX_WAIT_MS'] = int(os.environ.get('PASSWORD_HASH_MAX_WAIT_MS', 2000))
 
 # Initialize Extensions
 db = SQLAlchemy(app)
+with app.app_context():
+    set_sqlite_pragmas(app, db.engine)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
+password_hasher = PasswordHasher(workers=app.config['PASSWORD_HASH_WORKERS'],
+                                 method=app.config['PASSWORD_HASH_METHOD'],
+                                 max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+                                 max_wait_ms=app.config['PASSWORD_HASH_MAX_WAIT_MS'])
 
 # Database Models
 class User(db.Model, UserMixin):
@@ -34,35 +116,442 @@ class Product(db.Model):
     qr_code_path = db.Column(db.String(200), nullable=False)
     manufacturer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    history = db.relationship('TrackingHistory', backref='product', lazy=True)
+    history = db.relationship('TrackingHistory', backref='product', lazy=True,
+                              order_by='(TrackingHistory.timestamp, TrackingHistory.id)')
 
 class TrackingHistory(db.Model):
+    # A product's history is always read in timestamp order
+    __table_args__ = (db.Index('ix_tracking_history_product_timestamp', 'product_id', 'timestamp'),)
+
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     status = db.Column(db.String(100), nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_by = db.Column(db.Integer, db.ForeignKey('user.id'))  # Admin who updated this
 
+# Mirror of the Tracking.sol contract, filled by `flask index-chain`
+class ChainEvent(db.Model):
+    # One ProductUpdated log; (block_number, log_index) identifies it on chain
+    __table_args__ = (
+        db.Index('ix_chain_event_block_log', 'block_number', 'log_index', unique=True),
+        db.Index('ix_chain_event_product_block', 'product_id', 'block_number', 'log_index'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    block_number = db.Column(db.Integer, nullable=False)
+    block_hash = db.Column(db.String(66), nullable=False)
+    log_index = db.Column(db.Integer, nullable=False)
+    transaction_hash = db.Column(db.String(66), nullable=False)
+    product_id = db.Column(db.String(100), nullable=False)
+    location = db.Column(db.String(200), nullable=False)
+    delivered = db.Column(db.Boolean, nullable=False)
+
+class OnChainProduct(db.Model):
+    # Current on-chain state of a product, as of its last ProductUpdated event
+    product_id = db.Column(db.String(100), primary_key=True)
+    location = db.Column(db.String(200), nullable=False)
+    delivered = db.Column(db.Boolean, nullable=False, index=True)
+    block_number = db.Column(db.Integer, nullable=False)
+    log_index = db.Column(db.Integer, nullable=False)
+
+class ChainCheckpoint(db.Model):
+    # Last indexed block per contract, with its hash to detect reorgs
+    contract = db.Column(db.String(42), primary_key=True)
+    block_number = db.Column(db.Integer, nullable=False)
+    block_hash = db.Column(db.String(66), nullable=False)
+
+# Report aggregates, kept current by record_status_update and rebuilt from
+# the raw tables by `flask rebuild-reports`
+class ProductStatusCount(db.Model):
+    # Number of updates to each status per product
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    status = db.Column(db.String(100), primary_key=True)
+    updates = db.Column(db.Integer, nullable=False)
+
+class CurrentStatusCount(db.Model):
+    # Number of products whose latest update has this status
+    status = db.Column(db.String(100), primary_key=True)
+    products = db.Column(db.Integer, nullable=False)
+
+class TransitTime(db.Model):
+    # Time between consecutive updates of a product, per (from, to) status hop
+    from_status = db.Column(db.String(100), primary_key=True)
+    to_status = db.Column(db.String(100), primary_key=True)
+    hops = db.Column(db.Integer, nullable=False)
+    total_seconds = db.Column(db.Float, nullable=False)
+    max_seconds = db.Column(db.Float, nullable=False)
+
+# Latest tracking status of a product, loaded with it as a correlated subquery
+Product.status = db.column_property(
+    db.select(TrackingHistory.status)
+    .where(TrackingHistory.product_id == Product.id)
+    .order_by(TrackingHistory.timestamp.desc(), TrackingHistory.id.desc())
+    .limit(1)
+    .correlate_except(TrackingHistory)
+    .scalar_subquery()
+)
+
 # Login Manager
+user_cache = IdentityCache(max_entries=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-# Helper Function: Generate QR Code
-def generate_qr_code(batch_id):
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
+    user_id = int(user_id)
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        # Attach a copy of the cached state to this request's session without a query
+        return db.session.merge(cached, load=False)
+    generation = user_cache.generation()
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    # Cache this instance detached and hand the request an attached copy
+    db.session.expunge(user)
+    user_cache.set(user_id, user, generation)
+    return db.session.merge(user, load=False)
+
+# Changed or deleted users are dropped from the cache when the change is
+# flushed, and again after commit in case another request re-cached the old
+# row in between.
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
+    db.inspect(target).session.info.setdefault('changed_users', set()).add(target.id)
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_committed_users(session):
+    for user_id in session.info.pop('changed_users', ()):
+        user_cache.invalidate(user_id)
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_rolled_back_users(session):
+    session.info.pop('changed_users', None)
+
+# QR codes are rendered on demand by /qr/<batch_id>.png and cached
+qr_renderer = QRCodeRenderer(cache_size=app.config['QR_CACHE_SIZE'], cache_dir=app.config['QR_CACHE_DIR'])
+
+# Instrumentation: per-route SQL and template time come from engine and
+# template events, QR rendering and password hashing are wrapped here
+instrumentation = None
+if app.config['INSTRUMENTATION']:
+    instrumentation = Instrumentation(app, 'mediledger', profile_dir=app.config['PROFILE_DIR'],
+                                      profile_token=app.config['PROFILE_TOKEN'])
+    instrumentation.instrument(qr_renderer, 'render', 'qr')
+    instrumentation.instrument(password_hasher, 'hash', 'password_hash')
+    instrumentation.instrument(password_hasher, 'verify', 'password_hash')
+
+# Rendered consumer tracking pages, invalidated on every status update
+if app.config['TRACK_CACHE_BACKEND'] == 'redis':
+    track_cache_backend = RedisCacheBackend.from_url(app.config['TRACK_CACHE_URL'])
+else:
+    track_cache_backend = LRUCacheBackend(max_entries=app.config['TRACK_CACHE_SIZE'])
+track_cache = ResponseCache(track_cache_backend, ttl=app.config['TRACK_CACHE_TTL'])
+
+# Helper Function: URL a product's QR code points to
+def qr_code_target(batch_id, base_url=None):
+    base_url = base_url or app.config['QR_BASE_URL'] or request.url_root
+    return f"{base_url.rstrip('/')}/track/{batch_id}"
+
+def _warm_qr_code(target):
+    # Process pool worker: render into the disk cache, report failures per item
+    try:
+        qr_renderer.render(target, 'png')
+        return None
+    except Exception as exc:
+        return str(exc)
+
+# Helper Function: Create many products at once
+def bulk_create_products(names, manufacturer_id):
+    """
+    Generates batch ids for every name and inserts all products in a single
+    transaction. With a QR disk cache configured, the QR codes are
+    pre-rendered into it on a process pool.
+    :param names: Product names, in input order
+    :param manufacturer_id: Id of the manufacturing User
+    :return: Report with one result per name and the overall throughput
+    """
+    started = perf_counter()
+    results = []
+    for row, name in enumerate(names, start=1):
+        name = (name or '').strip()
+        if not name or len(name) > 100:
+            results.append({'row': row, 'name': name, 'status': 'error', 'error': 'Name must be 1-100 characters'})
+            continue
+        batch_id = str(uuid.uuid4())
+        results.append({'row': row, 'name': name, 'batch_id': batch_id, 'status': 'created'})
+
+    created = [result for result in results if result['status'] == 'created']
+    mappings = [{
+        'name': result['name'],
+        'batch_id': result['batch_id'],
+        'qr_code_path': f"qr/{result['batch_id']}.png",
+        'manufacturer_id': manufacturer_id,
+    } for result in created]
+
+    base_url = app.config['QR_BASE_URL'] or (request.url_root if has_request_context() else None)
+    if app.config['QR_CACHE_DIR'] and base_url and created:
+        targets = [qr_code_target(result['batch_id'], base_url) for result in created]
+        with ProcessPoolExecutor(max_workers=app.config['QR_WORKERS']) as pool:
+            for result, error in zip(created, pool.map(_warm_qr_code, targets, chunksize=64)):
+                result['qr_cached'] = error is None
+                if error:
+                    result['qr_error'] = error
+
+    db.session.bulk_insert_mappings(Product, mappings)
+    db.session.commit()
+
+    elapsed = perf_counter() - started
+    return {
+        'created': len(mappings),
+        'failed': len(results) - len(mappings),
+        'seconds': round(elapsed, 3),
+        'products_per_second': round(len(mappings) / elapsed, 1) if elapsed else None,
+        'results': results,
+    }
+
+def read_product_names(stream):
+    # CSV with a 'name' header column
+    return [row.get('name') for row in csv.DictReader(stream)]
+
+# Ledger: status updates are mirrored into the blockchain through a
+# write-behind mempool, so requests never wait for hashing or mining.
+_ledger = None
+_ledger_lock = threading.Lock()
+
+def get_ledger():
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            blockchain = Blockchain(storage_path=app.config['LEDGER_PATH'],
+                                    difficulty=app.config['LEDGER_DIFFICULTY'])
+            if instrumentation:
+                # Mining runs in the mempool thread, outside any request
+                rate = app.config['INSTRUMENTATION_SAMPLE_RATE']
+                instrumentation.sample(blockchain, 'proof_of_work', 'proof_of_work', rate)
+                instrumentation.sample(blockchain, 'validate_chain', 'validate_chain', rate)
+            _ledger = Mempool(blockchain,
+                              max_transactions=app.config['LEDGER_BLOCK_SIZE'],
+                              max_latency_ms=app.config['LEDGER_BLOCK_INTERVAL_MS'])
+            # Seal whatever is still queued when the process exits.
+            atexit.register(_ledger.close)
+        return _ledger
+
+# Live updates: the event server is started once per process at startup, never
+# from a request. If it cannot start, the app runs without live updates.
+_live_updates = None
+_live_updates_lock = threading.Lock()
+# Roles whose dashboards show every product's status, and so get a role stream
+LIVE_UPDATE_ROLES = ('distributor', 'pharmacy')
+
+def start_live_updates():
+    """
+    Starts this process's event server if LIVE_UPDATES is on. Failures, such
+    as the port being taken, are logged and leave live updates off.
+    :return: The started LiveUpdates, or None
+    """
+    global _live_updates
+    if not app.config['LIVE_UPDATES']:
+        return None
+    with _live_updates_lock:
+        if _live_updates is None:
+            try:
+                if app.config['LIVE_UPDATES_REDIS_URL']:
+                    broker = RedisBroker.from_url(app.config['LIVE_UPDATES_REDIS_URL'])
+                else:
+                    broker = LocalBroker()
+                live_updates = LiveUpdates(broker, app.config['SECRET_KEY'],
+                                           host=app.config['LIVE_UPDATES_HOST'],
+                                           port=app.config['LIVE_UPDATES_PORT'],
+                                           roles=LIVE_UPDATE_ROLES,
+                                           token_max_age=app.config['LIVE_UPDATES_TOKEN_MAX_AGE'])
+                live_updates.start()
+            except Exception:
+                app.logger.exception('Live updates could not start; continuing without them')
+                return None
+            _live_updates = live_updates
+        return _live_updates
+
+def get_live_updates():
+    """
+    :return: The running LiveUpdates, or None when it is off or failed to start
+    """
+    return _live_updates
+
+@app.context_processor
+def live_updates_settings():
+    # Templates build the stream URL in the browser from these, so cached
+    # pages do not depend on the host they were first rendered for
+    return {'live_updates': {'enabled': _live_updates is not None, 'url': app.config['LIVE_UPDATES_URL'],
+                             'port': app.config['LIVE_UPDATES_PORT']}}
+
+def live_role_token():
+    live_updates = get_live_updates()
+    if live_updates is None or current_user.role not in LIVE_UPDATE_ROLES:
+        return None
+    return live_updates.role_token(current_user.role, current_user.id)
+
+# Helper Function: Record a status update in SQL and queue it for the ledger
+def record_status_update(product_id, status, recipient):
+    product = db.get_or_404(Product, product_id)
+    previous = db.session.execute(
+        db.select(TrackingHistory.status, TrackingHistory.timestamp)
+        .where(TrackingHistory.product_id == product.id)
+        .order_by(TrackingHistory.timestamp.desc(), TrackingHistory.id.desc())
+        .limit(1)
+    ).first()
+    history = TrackingHistory(product_id=product.id, status=status, updated_by=current_user.id)
+    db.session.add(history)
+    db.session.flush()
+    # The report aggregates change in the same transaction as the history
+    count_status_update(product.id, previous, history)
+    db.session.commit()
+    track_cache.invalidate(product.batch_id)
+    get_ledger().submit(current_user.username, recipient, product.batch_id, status)
+    # Only committed updates are pushed, as a delta of the one new entry
+    live_updates = get_live_updates()
+    if live_updates is not None:
+        try:
+            live_updates.publish([f'batch:{product.batch_id}'] + [f'role:{role}' for role in LIVE_UPDATE_ROLES],
+                                 history.id,
+                                 {'product_id': product.id, 'batch_id': product.batch_id, 'status': history.status,
+                                  'timestamp': str(history.timestamp), 'updated_by': current_user.username})
+        except Exception:
+            # The update is committed; a lost push only means clients see it on their next load
+            app.logger.exception('Could not publish live update for %s', product.batch_id)
+    return history
+
+# Helper Function: Fold one status update into the report aggregates
+def count_status_update(product_id, previous, history):
+    """
+    :param previous: (status, timestamp) of the product's latest update
+                     before this one, or None for its first update
+    :param history: The new, flushed TrackingHistory
+    """
+    add_to_aggregate(db, ProductStatusCount, {'product_id': product_id, 'status': history.status}, sums={'updates': 1})
+    if previous is not None and previous.status == history.status:
+        return
+    add_to_aggregate(db, CurrentStatusCount, {'status': history.status}, sums={'products': 1})
+    if previous is None:
+        return
+    add_to_aggregate(db, CurrentStatusCount, {'status': previous.status}, sums={'products': -1})
+    if previous.timestamp is not None:
+        seconds = (history.timestamp - previous.timestamp).total_seconds()
+        add_to_aggregate(db, TransitTime, {'from_status': previous.status, 'to_status': history.status},
+                         sums={'hops': 1, 'total_seconds': seconds}, maximums={'max_seconds': seconds})
+
+def rebuild_report_aggregates(batch_size=10000):
+    """
+    Recomputes the report aggregates from tracking_history in one pass over a
+    server-side cursor, in product and time order, holding only the current
+    product's counts and the per-hop totals in memory. The tables are
+    replaced in one transaction, so the reports page never sees them half built.
+    :return: Dictionary with the number of rows read and written
+    """
+    db.session.execute(db.delete(ProductStatusCount))
+    db.session.execute(db.delete(CurrentStatusCount))
+    db.session.execute(db.delete(TransitTime))
+
+    history = db.session.execute(
+        db.select(TrackingHistory.product_id, TrackingHistory.status, TrackingHistory.timestamp)
+        .order_by(TrackingHistory.product_id, TrackingHistory.timestamp, TrackingHistory.id)
+        .execution_options(yield_per=batch_size)
     )
-    qr.add_data(f"http://192.168.0.105:8080/track/{batch_id}")
-    qr.make(fit=True)
-    qr_code_path = os.path.join('static/qr_codes', f"{batch_id}.png")
-    os.makedirs(os.path.dirname(qr_code_path), exist_ok=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    img.save(qr_code_path)
-    return qr_code_path
+    report = {'history': 0, 'product_status_counts': 0}
+    current = {}
+    transit = {}
+    pending = []
+    product_id, counts, previous = None, {}, None
+
+    def finish_product():
+        pending.extend({'product_id': product_id, 'status': status, 'updates': updates}
+                       for status, updates in counts.items())
+        if previous is not None:
+            current[previous.status] = current.get(previous.status, 0) + 1
+
+    for row in history:
+        if row.product_id != product_id:
+            if product_id is not None:
+                finish_product()
+                if len(pending) >= batch_size:
+                    db.session.execute(db.insert(ProductStatusCount), pending)
+                    report['product_status_counts'] += len(pending)
+                    pending.clear()
+            product_id, counts, previous = row.product_id, {}, None
+        counts[row.status] = counts.get(row.status, 0) + 1
+        if previous is not None and previous.status != row.status and None not in (previous.timestamp, row.timestamp):
+            seconds = (row.timestamp - previous.timestamp).total_seconds()
+            totals = transit.setdefault((previous.status, row.status), [0, 0.0, seconds])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+        previous = row
+        report['history'] += 1
+    if product_id is not None:
+        finish_product()
+
+    if pending:
+        db.session.execute(db.insert(ProductStatusCount), pending)
+        report['product_status_counts'] += len(pending)
+    if current:
+        db.session.execute(db.insert(CurrentStatusCount),
+                           [{'status': status, 'products': products} for status, products in current.items()])
+    if transit:
+        db.session.execute(db.insert(TransitTime), [
+            {'from_status': from_status, 'to_status': to_status, 'hops': hops, 'total_seconds': total,
+             'max_seconds': longest}
+            for (from_status, to_status), (hops, total, longest) in transit.items()])
+    db.session.commit()
+    report['statuses'] = len(current)
+    report['hops'] = len(transit)
+    return report
+
+# Helper Function: One keyset-paginated page of products
+def product_page(with_history=False):
+    """
+    Reads the listing arguments from the query string:
+    after (last product id seen), limit, status and manufacturer (user id).
+    :return: (products, next_cursor); next_cursor is None on the last page
+    """
+    limit = max(1, min(request.args.get('limit', app.config['PRODUCTS_PER_PAGE'], type=int),
+                       app.config['MAX_PRODUCTS_PER_PAGE']))
+    query = db.select(Product).order_by(Product.id).limit(limit + 1)
+    after = request.args.get('after', type=int)
+    if after is not None:
+        query = query.where(Product.id > after)
+    status = request.args.get('status')
+    if status:
+        query = query.where(Product.status == status)
+    manufacturer_id = request.args.get('manufacturer', type=int)
+    if manufacturer_id is not None:
+        query = query.where(Product.manufacturer_id == manufacturer_id)
+    if with_history:
+        query = query.options(selectinload(Product.history))
+
+    products = db.session.execute(query).scalars().all()
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        next_cursor = products[-1].id
+    return products, next_cursor
+
+def product_to_dict(product, with_history=False):
+    data = {
+        'id': product.id,
+        'name': product.name,
+        'batch_id': product.batch_id,
+        'status': product.status,
+        'manufacturer_id': product.manufacturer_id,
+        'qr_code_url': url_for('qr_code', batch_id=product.batch_id, fmt='png'),
+    }
+    if with_history:
+        data['history'] = [{'status': entry.status, 'timestamp': str(entry.timestamp)} for entry in product.history]
+    return data
+
+# Registrations and logins beyond what the hashing pool can absorb are turned away
+@app.errorhandler(HashingOverloaded)
+def hashing_overloaded(error):
+    return 'Too many sign-in attempts right now, please retry shortly.', 503, {'Retry-After': str(error.retry_after)}
 
 # Routes
 @app.route('/')
@@ -83,8 +572,8 @@ def register():
             flash('Email already registered!', 'danger')
             return redirect(url_for('register'))
 
-        # Correct password hashing method
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
+        # Hashed on the bounded pool with the configured method and cost
+        hashed_password = password_hasher.hash(password)
 
         # Create new user
         new_user = User(username=username, email=email, password=hashed_password, role=role)
@@ -104,7 +593,7 @@ def login():
         password = request.form['password']
         role = request.form['role']  # Added role validation
         user = User.query.filter_by(email=email, role=role).first()  # Validate both email and role
-        if user and check_password_hash(user.password, password):
+        if user and password_hasher.verify(user.password, password):
             login_user(user)
             if role == 'manufacturer':
                 return redirect(url_for('manufacturer'))
@@ -131,8 +620,7 @@ def manufacturer():
     if request.method == 'POST':
         name = request.form['name']
         batch_id = str(uuid.uuid4())
-        qr_code_path = generate_qr_code(batch_id)
-        product = Product(name=name, batch_id=batch_id, qr_code_path=qr_code_path, manufacturer_id=current_user.id)
+        product = Product(name=name, batch_id=batch_id, qr_code_path=f"qr/{batch_id}.png", manufacturer_id=current_user.id)
         db.session.add(product)
         db.session.commit()
         flash('Product added and QR code generated!', 'success')
@@ -140,6 +628,18 @@ def manufacturer():
     products = Product.query.filter_by(manufacturer_id=current_user.id).all()
     return render_template('manufacturer.html', products=products)
 
+# Manufacturer: Bulk-create products from an uploaded CSV
+@app.route('/manufacturer/bulk', methods=['POST'])
+@login_required
+def manufacturer_bulk():
+    if current_user.role != 'manufacturer':
+        abort(403)
+    upload = request.files.get('file')
+    if upload is None:
+        abort(400)
+    names = read_product_names(io.TextIOWrapper(upload.stream, encoding='utf-8-sig'))
+    return jsonify(bulk_create_products(names, current_user.id))
+
 # Distributor Dashboard
 @app.route('/distributor', methods=['GET', 'POST'])
 @login_required
@@ -151,16 +651,16 @@ def distributor():
         product_id = request.form['product_id']
         status = request.form['status']
         
-        # Create a new entry in TrackingHistory
-        history = TrackingHistory(product_id=product_id, status=status, updated_by=current_user.id)
-        db.session.add(history)
-        db.session.commit()
+        # Create a new entry in TrackingHistory and mirror it into the ledger
+        record_status_update(product_id, status, recipient='pharmacy')
         
         flash('Tracking status updated successfully!', 'success')
+        return redirect(request.full_path)
     
-    # Fetch all products (added by manufacturers)
-    products = Product.query.all()
-    return render_template('distributor.html', products=products)
+    # Fetch the first page of products (added by manufacturers); the page loads the rest from /api/products
+    products, next_cursor = product_page()
+    return render_template('distributor.html', products=products, next_cursor=next_cursor,
+                           live_token=live_role_token())
 
 
 # Pharmacy Dashboard
@@ -174,40 +674,147 @@ def pharmacy():
         product_id = request.form['product_id']
         status = request.form['status']
         
-        # Create a new entry in TrackingHistory
-        history = TrackingHistory(product_id=product_id, status=status, updated_by=current_user.id)
-        db.session.add(history)
-        db.session.commit()
+        # Create a new entry in TrackingHistory and mirror it into the ledger
+        record_status_update(product_id, status, recipient='consumer')
         flash('Tracking status updated!', 'success')
+        return redirect(request.full_path)
     
-    # Fetch all products along with their tracking history
-    products = Product.query.all()
+    # Fetch the first page of products along with their tracking history
+    products, next_cursor = product_page(with_history=True)
     
-    return render_template('pharmacy.html', products=products)
+    return render_template('pharmacy.html', products=products, next_cursor=next_cursor,
+                           live_token=live_role_token())
+
+
+# Product listing API used by the dashboards to page through products
+@app.route('/api/products')
+@login_required
+def api_products():
+    with_history = request.args.get('history') == '1'
+    products, next_cursor = product_page(with_history=with_history)
+    return jsonify({
+        'products': [product_to_dict(product, with_history) for product in products],
+        'next_cursor': next_cursor,
+    })
 
 
 
+# Reports: read from the aggregate tables, never from the raw history
+@app.route('/reports')
+@login_required
+def view_reports():
+    current = db.session.execute(db.select(CurrentStatusCount).where(CurrentStatusCount.products > 0)
+                                 .order_by(CurrentStatusCount.products.desc())).scalars().all()
+    transit = db.session.execute(db.select(TransitTime)
+                                 .order_by(TransitTime.from_status, TransitTime.to_status)).scalars().all()
+    # Per-product counts for one keyset page of products
+    products, next_cursor = product_page()
+    counts = {}
+    if products:
+        for row in db.session.execute(db.select(ProductStatusCount)
+                                      .where(ProductStatusCount.product_id.in_([product.id for product in products]))).scalars():
+            counts.setdefault(row.product_id, {})[row.status] = row.updates
+    return render_template('view_reports.html', current=current, transit=transit, products=products,
+                           counts=counts, next_cursor=next_cursor)
+
+
+# Streaming exports: rows are read through a server-side cursor and encoded as
+# the response is sent, so memory stays flat however large the table is.
+# Each export can be resumed with ?after=<last id exported>.
+@app.route('/export/products.<any(csv, ndjson):fmt>')
+@login_required
+def export_products(fmt):
+    query = (db.select(Product.id, Product.name, Product.batch_id, Product.manufacturer_id, Product.created_at,
+                       Product.status)
+             .order_by(Product.id))
+    after = request.args.get('after', type=int)
+    if after is not None:
+        query = query.where(Product.id > after)
+    manufacturer_id = request.args.get('manufacturer', type=int)
+    if manufacturer_id is not None:
+        query = query.where(Product.manufacturer_id == manufacturer_id)
+    rows = db.session.execute(query.execution_options(yield_per=app.config['EXPORT_BATCH_SIZE']))
+    return export_response(['id', 'name', 'batch_id', 'manufacturer_id', 'created_at', 'status'], rows, fmt, 'products')
+
+@app.route('/export/history.<any(csv, ndjson):fmt>')
+@login_required
+def export_history(fmt):
+    query = (db.select(TrackingHistory.id, Product.batch_id, TrackingHistory.status, TrackingHistory.timestamp,
+                       User.username)
+             .join(Product, TrackingHistory.product_id == Product.id)
+             .outerjoin(User, TrackingHistory.updated_by == User.id)
+             .order_by(TrackingHistory.id))
+    after = request.args.get('after', type=int)
+    if after is not None:
+        query = query.where(TrackingHistory.id > after)
+    batch_id = request.args.get('batch_id')
+    if batch_id:
+        query = query.where(Product.batch_id == batch_id)
+    rows = db.session.execute(query.execution_options(yield_per=app.config['EXPORT_BATCH_SIZE']))
+    return export_response(['id', 'batch_id', 'status', 'timestamp', 'updated_by'], rows, fmt, 'tracking_history')
+
+@app.route('/export/ledger.<any(csv, ndjson):fmt>')
+@login_required
+def export_ledger(fmt):
+    # Blocks are decoded one at a time from the block store; CSV carries the
+    # transaction count, NDJSON the transactions themselves
+    start = request.args.get('after', 0, type=int)
+    columns = ['index', 'timestamp', 'proof', 'previous_hash', 'merkle_root', 'transactions']
+    rows = ([block[column] for column in columns[:-1]]
+            + [len(block['transactions']) if fmt == 'csv' else block['transactions']]
+            for block in get_ledger().blockchain.get_blockchain_data(start))
+    return export_response(columns, rows, fmt, 'ledger')
+
+
 # Consumer: Track Product
 @app.route('/track/<batch_id>')
 def track_product(batch_id):
-    product = Product.query.filter_by(batch_id=batch_id).first_or_404()
-    
-    # Retrieve the manufacturer (User) and distributor (User) from the Product model
-    manufacturer = User.query.get(product.manufacturer_id)
-    distributor = User.query.filter_by(role='distributor').first()  # Assuming there's one distributor, adjust as needed
-    
-    # Retrieve the tracking history for the product
-    history = TrackingHistory.query.filter_by(product_id=product.id).all()
-
-    # Create a list to store user data (updated_by users)
-    history_details = []
-    for entry in history:
-        updated_user = User.query.get(entry.updated_by)  # Retrieve the user (pharmacy or admin) who updated the status
-        history_details.append({
-            'status': entry.status,
-            'timestamp': entry.timestamp,
-            'updated_by': updated_user.username if updated_user else 'Unknown'
-        })
+    # Scans are served from the rendered-page cache; browsers revalidate with the ETag
+    cached = track_cache.get(batch_id)
+    if cached is None:
+        # Taken before rendering: a status update committed meanwhile keeps this page out of the cache
+        generation = track_cache.generation()
+        body = render_track_page(batch_id).encode()
+        etag = hashlib.sha256(body).hexdigest()
+        track_cache.set(batch_id, etag, body, generation)
+    else:
+        etag, body = cached
+
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype='text/html')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+def render_track_page(batch_id):
+    # Product and manufacturer in one query
+    row = db.session.execute(
+        db.select(Product, User)
+        .join(User, Product.manufacturer_id == User.id)
+        .where(Product.batch_id == batch_id)
+    ).first()
+    if row is None:
+        abort(404)
+    product, manufacturer = row
+
+    # Tracking history joined with the users who updated it, oldest first
+    history = db.session.execute(
+        db.select(TrackingHistory.status, TrackingHistory.timestamp, User.username, User.role)
+        .outerjoin(User, TrackingHistory.updated_by == User.id)
+        .where(TrackingHistory.product_id == product.id)
+        .order_by(TrackingHistory.timestamp, TrackingHistory.id)
+    ).all()
+
+    history_details = [{
+        'status': entry.status,
+        'timestamp': entry.timestamp,
+        'updated_by': entry.username or 'Unknown'
+    } for entry in history]
+
+    # The distributor is whoever last handled the product in that role
+    distributor = next((entry for entry in reversed(history) if entry.role == 'distributor'), None)
 
     # Pass all the necessary information to the template
     return render_template(
@@ -219,11 +826,131 @@ def track_product(batch_id):
     )
 
 
+# QR code for a product, rendered on demand and cached
+@app.route('/qr/<batch_id>.<any(png, svg):fmt>')
+def qr_code(batch_id, fmt):
+    target = qr_code_target(batch_id)
+    etag = QRCodeRenderer.key(target, fmt)
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        image = qr_renderer.get(target, fmt)
+        if image is None:
+            # Only render codes for products that exist
+            if not db.session.query(db.exists().where(Product.batch_id == batch_id)).scalar():
+                abort(404)
+            image = qr_renderer.render(target, fmt)
+        response = app.response_class(image, mimetype=MIMETYPES[fmt])
+    response.set_etag(etag)
+    if app.config['QR_BASE_URL']:
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+    response.cache_control.max_age = app.config['QR_MAX_AGE']
+    return response
+
+
+@app.route('/cache/metrics')
+def cache_metrics():
+    return jsonify({'track': track_cache.stats(), 'qr': qr_renderer.stats(), 'users': user_cache.stats()})
+
+
+# On-chain state of a product, served from the SQL mirror without any RPC
+@app.route('/track/<batch_id>/onchain')
+def track_product_onchain(batch_id):
+    product = db.get_or_404(OnChainProduct, batch_id)
+    events = db.session.execute(
+        db.select(ChainEvent).where(ChainEvent.product_id == batch_id)
+        .order_by(ChainEvent.block_number.desc(), ChainEvent.log_index.desc())
+        .limit(50)
+    ).scalars()
+    return jsonify({
+        'product_id': product.product_id,
+        'location': product.location,
+        'delivered': product.delivered,
+        'block_number': product.block_number,
+        'history': [{'block_number': event.block_number, 'transaction_hash': event.transaction_hash,
+                     'location': event.location, 'delivered': event.delivered} for event in events],
+    })
+
+
+# Ledger inclusion proof for a product's latest (or a given) status
+@app.route('/track/<batch_id>/proof')
+def track_product_proof(batch_id):
+    product = Product.query.filter_by(batch_id=batch_id).first_or_404()
+    status = request.args.get('status')
+    if status is None:
+        latest = TrackingHistory.query.filter_by(product_id=product.id).order_by(TrackingHistory.timestamp.desc()).first_or_404()
+        status = latest.status
+    proof = get_ledger().blockchain.prove_transaction(batch_id, status)
+    if proof is None:
+        abort(404)
+    return jsonify(proof)
+
+
+@app.route('/live/metrics')
+def live_metrics():
+    live_updates = get_live_updates()
+    return jsonify(live_updates.stats() if live_updates else {'enabled': False})
+
+
+@app.route('/ledger/metrics')
+def ledger_metrics():
+    return jsonify(get_ledger().metrics())
+
+
 # Initialize the Database
+def ensure_indexes():
+    create_missing_indexes(db)
+
 with app.app_context():
     db.create_all()
+    ensure_indexes()
+
+
+@app.cli.command('index-chain')
+@click.option('--follow', is_flag=True, help='Keep polling for new blocks')
+@click.option('--interval', default=5.0, show_default=True, help='Seconds between polls with --follow')
+def index_chain_command(follow, interval):
+    """Mirror ProductUpdated events of the Tracking contract into SQL."""
+    address = app.config['CHAIN_CONTRACT_ADDRESS']
+    if not address:
+        raise click.UsageError('Set CHAIN_CONTRACT_ADDRESS to the deployed Tracking contract')
+    indexer = ChainIndexer(JsonRpcClient(app.config['CHAIN_RPC_URL']), address,
+                           SqlChainStore(db, ChainEvent, OnChainProduct, ChainCheckpoint, address),
+                           batch_size=app.config['CHAIN_BATCH_BLOCKS'],
+                           reorg_depth=app.config['CHAIN_REORG_DEPTH'],
+                           confirmations=app.config['CHAIN_CONFIRMATIONS'],
+                           start_block=app.config['CHAIN_START_BLOCK'])
+    while True:
+        click.echo(json.dumps(indexer.run()))
+        if not follow:
+            return
+        sleep(interval)
+
+
+@app.cli.command('rebuild-reports')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows fetched and written per round trip')
+def rebuild_reports_command(batch_size):
+    """Recompute the report aggregates from the tracking history."""
+    click.echo(json.dumps(rebuild_report_aggregates(batch_size), indent=2))
+
+
+@app.cli.command('import-products')
+@click.argument('csv_file', type=click.File(encoding='utf-8-sig'))
+@click.option('--manufacturer', required=True, help='Email of the manufacturer account')
+def import_products_command(csv_file, manufacturer):
+    """Bulk-create products from a CSV file with a 'name' column."""
+    user = User.query.filter_by(email=manufacturer, role='manufacturer').first()
+    if user is None:
+        raise click.BadParameter('No manufacturer with that email', param_hint='--manufacturer')
+    report = bulk_create_products(read_product_names(csv_file), user.id)
+    click.echo(json.dumps(report, indent=2))
 
 
 if __name__ == '__main__':
+    # With the debug reloader, only the child process that serves requests starts the event server
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_live_updates()
     app.run(host='0.0.0.0', port=8080,debug=True)
 
@@ -0,0 +1,133 @@
+"""
+Helpers shared by the benchmark scripts: latency summaries, a concurrent
+HTTP client loop and run metadata for comparing results across commits.
+"""
+import http.cookiejar
+import os
+import platform
+import subprocess
+import sys
+import threading
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRESCRIPTION_APP = os.path.join(ROOT, 'MediLedger_Prescription')
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(latencies, elapsed=None, errors=0):
+    """
+    :param latencies: Seconds per operation
+    :param elapsed: (Optional) Wall-clock seconds for all operations; defaults
+                    to their sum, i.e. sequential execution
+    :return: Dictionary with the count, p50/p95/p99/max in milliseconds and
+             operations per second
+    """
+    elapsed = sum(latencies) if elapsed is None else elapsed
+    summary = {
+        'count': len(latencies),
+        'errors': errors,
+        'ops_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+    }
+    for name, fraction in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+        value = percentile(latencies, fraction)
+        summary[name] = round(value * 1000, 3) if value is not None else None
+    summary['max_ms'] = round(max(latencies) * 1000, 3) if latencies else None
+    return summary
+
+
+def time_calls(function, arguments):
+    """
+    Calls function once per item of arguments.
+    :return: List of seconds per call
+    """
+    latencies = []
+    for argument in arguments:
+        started = perf_counter()
+        function(argument)
+        latencies.append(perf_counter() - started)
+    return latencies
+
+
+def serve(app):
+    """
+    Starts app on a threaded local WSGI server.
+    :return: (server, base URL); call server.shutdown() when done
+    """
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def run_clients(base, clients, seconds, login, next_request):
+    """
+    Drives a server with concurrent clients, each with its own cookie jar.
+    :param login: login(client number) -> (path, form dict) posted once per client, or None
+    :param next_request: next_request(client number, request number) -> (route name, path)
+    :return: Dictionary of route name -> summary, plus 'total'
+    """
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+    deadline = perf_counter() + seconds
+
+    def client(number):
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        credentials = login(number)
+        if credentials:
+            path, form = credentials
+            opener.open(base + path, urllib.parse.urlencode(form).encode()).read()
+        request_number = 0
+        while perf_counter() < deadline:
+            route, path = next_request(number, request_number)
+            request_number += 1
+            started = perf_counter()
+            try:
+                opener.open(base + path).read()
+            except Exception:
+                with lock:
+                    errors[route] = errors.get(route, 0) + 1
+                continue
+            with lock:
+                latencies.setdefault(route, []).append(perf_counter() - started)
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    started = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - started
+
+    results = {route: summarize(samples, elapsed, errors.get(route, 0)) for route, samples in latencies.items()}
+    results['total'] = summarize([sample for samples in latencies.values() for sample in samples], elapsed,
+                                 sum(errors.values()))
+    return results
+
+
+def metadata():
+    """
+    :return: Where and on what the benchmark ran, to tell result files apart
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
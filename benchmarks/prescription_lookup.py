@@ -0,0 +1,114 @@
+"""
+Benchmark: pharmacy_dashboard patient lookup as the prescription table grows.
+
+Seeds a fresh SQLite file for MediLedger_Prescription/app.py in steps up to
+--rows prescriptions (about ten per patient) and, after each step, times
+dashboard searches for random patients through the Flask test client. With
+the (name, dob) and (pharmacy_id, patient_id, timestamp) indexes the latency
+should stay flat from the first step to the last.
+
+    python benchmarks/prescription_lookup.py --rows 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from common import ROOT, percentile
+from seed import patient_key
+
+PRESCRIPTIONS_PER_PATIENT = 10
+DOCTORS = 50
+PHARMACIES = 20
+
+
+def seed(path, start, stop):
+    """
+    Inserts patients start..stop-1 and their prescriptions with raw
+    executemany; going through the ORM would dominate the run time.
+    """
+    connection = sqlite3.connect(path)
+    base = datetime(2024, 1, 1)
+    with connection:
+        connection.executemany('INSERT INTO patient (id, name, dob) VALUES (?, ?, ?)',
+                               ((n + 1, *patient_key(n)) for n in range(start, stop)))
+        connection.executemany(
+            'INSERT INTO prescription (patient_id, doctor_id, pharmacy_id, medicine_list, dosage, timestamp, fulfilled) '
+            'VALUES (?, ?, ?, ?, ?, ?, 0)',
+            ((n + 1, n % DOCTORS + 1, (n + i) % 2 + 1, 'Paracetamol (1 tablet twice a day)', '',
+              (base + timedelta(minutes=n * PRESCRIPTIONS_PER_PATIENT + i)).isoformat(sep=' '))
+             for n in range(start, stop) for i in range(PRESCRIPTIONS_PER_PATIENT)))
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='Prescriptions at the last step')
+    parser.add_argument('--steps', type=int, default=3, help='Number of table sizes, each 10x the previous')
+    parser.add_argument('--lookups', type=int, default=500, help='Dashboard searches per step')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='prescription-lookup-')
+    path = os.path.join(workdir, 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    # Imported here so DATABASE_URL is set first
+    sys.path.insert(0, os.path.join(ROOT, 'MediLedger_Prescription'))
+    import app as prescriptions
+
+    with prescriptions.app.app_context():
+        prescriptions.db.create_all()
+        prescriptions.ensure_indexes()
+        for number in range(DOCTORS):
+            prescriptions.db.session.add(prescriptions.Doctor(
+                name=f'Doctor {number}', hospital_name='General', contact_info=f'doctor{number}@bench',
+                password_hash='-', id_proof='-', approved=True))
+        for number in range(PHARMACIES):
+            prescriptions.db.session.add(prescriptions.Pharmacy(
+                name=f'Pharmacy {number}', address='-', contact_info=f'pharmacy{number}@bench', password_hash='-'))
+        prescriptions.db.session.commit()
+
+    client = prescriptions.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['role'] = 'pharmacy'
+
+    sizes = [args.rows // 10 ** step for step in reversed(range(args.steps))]
+    seeded = 0
+    results = []
+    for size in sizes:
+        patients = size // PRESCRIPTIONS_PER_PATIENT
+        started = perf_counter()
+        seed(path, seeded, patients)
+        seed_seconds = perf_counter() - started
+        seeded = patients
+
+        latencies = []
+        for _ in range(args.lookups):
+            name, dob = patient_key(random.randrange(patients))
+            started = perf_counter()
+            response = client.get('/pharmacy_dashboard', query_string={'patient_name': name, 'patient_dob': dob.isoformat()})
+            latencies.append(perf_counter() - started)
+            assert response.status_code == 200, response.status_code
+
+        result = {
+            'prescriptions': patients * PRESCRIPTIONS_PER_PATIENT,
+            'patients': patients,
+            'seed_seconds': round(seed_seconds, 2),
+            'lookups': len(latencies),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        }
+        results.append(result)
+        print(json.dumps(result), file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+Benchmark suite for app.py, MediLedger_Prescription/app.py and the ledger.
+
+For every scale, each app gets a fresh SQLite file seeded by seed.py and runs
+in its own process. The hot routes are timed sequentially through the Flask
+test client, then under concurrent clients on a local threaded WSGI server.
+The ledger part microbenchmarks Blockchain.new_block, hash, proof_of_work and
+validate_chain on an in-memory chain.
+
+Results go to stdout (or --output) as JSON with p50/p95/p99 latency and
+throughput per route, plus the commit they were measured on, so runs can be
+diffed across commits.
+
+    python benchmarks/run_suite.py --scales 10000 100000 1000000 --output results.json
+    python benchmarks/run_suite.py --suites ledger --ledger-blocks 20000
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+from common import PRESCRIPTION_APP, ROOT, metadata, run_clients, serve, summarize, time_calls
+import seed
+
+SUITES = ('tracking', 'prescriptions', 'ledger')
+
+
+def import_app(directory):
+    # Imported here so DATABASE_URL and the other settings are in the environment first
+    sys.path.insert(0, directory)
+    import app
+    return app
+
+
+def test_client_login(module, path, form):
+    client = module.app.test_client()
+    response = client.post(path, data=form)
+    assert response.status_code == 302, f'login to {path} failed with {response.status_code}'
+    return client
+
+
+def time_route(client, paths):
+    """
+    :param paths: Iterable of request paths
+    :return: Summary of sequential GETs through the test client
+    """
+    def get(path):
+        response = client.get(path)
+        assert response.status_code == 200, f'{path} returned {response.status_code}'
+    return summarize(time_calls(get, paths))
+
+
+def tracking_worker(scale, args):
+    tracking = import_app(ROOT)
+    with tracking.app.app_context():
+        tracking.db.create_all()
+        tracking.ensure_indexes()
+    started = perf_counter()
+    sizes = seed.seed_tracking(tracking.app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''), scale)
+    seed_seconds = perf_counter() - started
+
+    products = sizes['products']
+    hot = [seed.batch_id(number) for number in random.sample(range(products), min(50, products))]
+    distributor = test_client_login(tracking, '/login', {'email': 'distributor-0@bench', 'password': seed.PASSWORD,
+                                                         'role': 'distributor'})
+    pharmacy = test_client_login(tracking, '/login', {'email': 'pharmacy-0@bench', 'password': seed.PASSWORD,
+                                                      'role': 'pharmacy'})
+    anonymous = tracking.app.test_client()
+    requests = args.requests
+    test_client = {
+        # Random products miss the rendered-page cache; the hot set hits it
+        'track_uncached': time_route(anonymous, (f'/track/{seed.batch_id(random.randrange(products))}'
+                                                 for _ in range(requests))),
+        'track_cached': time_route(anonymous, (f'/track/{random.choice(hot)}' for _ in range(requests))),
+        'distributor': time_route(distributor, ('/distributor' for _ in range(requests))),
+        'pharmacy': time_route(pharmacy, ('/pharmacy' for _ in range(requests))),
+    }
+
+    roles = ('distributor', 'pharmacy', None)
+    routes = {'distributor': '/distributor', 'pharmacy': '/pharmacy'}
+
+    def login(number):
+        role = roles[number % len(roles)]
+        if role is None:
+            return None
+        user = number // len(roles) % sizes['users_per_role']
+        return '/login', {'email': f'{role}-{user}@bench', 'password': seed.PASSWORD, 'role': role}
+
+    def next_request(number, request_number):
+        role = roles[number % len(roles)]
+        if role is None:
+            if request_number % 2:
+                return 'track_cached', f'/track/{random.choice(hot)}'
+            return 'track_uncached', f'/track/{seed.batch_id(random.randrange(products))}'
+        return role, routes[role]
+
+    server, base = serve(tracking.app)
+    try:
+        wsgi = run_clients(base, args.clients, args.seconds, login, next_request)
+    finally:
+        server.shutdown()
+    return {'sizes': sizes, 'seed_seconds': round(seed_seconds, 2), 'test_client': test_client,
+            'wsgi': {'clients': args.clients, 'seconds': args.seconds, 'routes': wsgi}}
+
+
+def prescriptions_worker(scale, args):
+    prescriptions = import_app(PRESCRIPTION_APP)
+    with prescriptions.app.app_context():
+        prescriptions.db.create_all()
+        prescriptions.ensure_indexes()
+    started = perf_counter()
+    sizes = seed.seed_prescriptions(prescriptions.app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', ''), scale)
+    seed_seconds = perf_counter() - started
+
+    def lookup_path(number):
+        name, dob = seed.patient_key(number)
+        return f'/pharmacy_dashboard?patient_name={name.replace(" ", "+")}&patient_dob={dob.isoformat()}'
+
+    def search_path():
+        return f'/medicines/search?q=medicine+{random.randrange(100):02d}'
+
+    patients = sizes['patients']
+    # Pharmacy 1 receives the even-numbered prescriptions of every patient
+    pharmacy = test_client_login(prescriptions, '/login', {'email': 'pharmacy-0@bench', 'password': seed.PASSWORD,
+                                                           'role': 'pharmacy'})
+    doctor = test_client_login(prescriptions, '/login', {'email': 'doctor-0@bench', 'password': seed.PASSWORD,
+                                                         'role': 'doctor'})
+    requests = args.requests
+    test_client = {
+        'pharmacy_dashboard': time_route(pharmacy, (lookup_path(random.randrange(patients)) for _ in range(requests))),
+        'doctor_dashboard': time_route(doctor, ('/doctor_dashboard' for _ in range(requests))),
+        'medicine_search': time_route(doctor, (search_path() for _ in range(requests))),
+    }
+
+    def login(number):
+        role = ('pharmacy', 'doctor')[number % 2]
+        # Only pharmacies 0 and 1 have prescriptions
+        user = number // 2 % (2 if role == 'pharmacy' else sizes['doctors'])
+        return '/login', {'email': f'{role}-{user}@bench', 'password': seed.PASSWORD, 'role': role}
+
+    def next_request(number, request_number):
+        if number % 2 == 0:
+            return 'pharmacy_dashboard', lookup_path(random.randrange(patients))
+        if request_number % 2:
+            return 'medicine_search', search_path()
+        return 'doctor_dashboard', '/doctor_dashboard'
+
+    server, base = serve(prescriptions.app)
+    try:
+        wsgi = run_clients(base, args.clients, args.seconds, login, next_request)
+    finally:
+        server.shutdown()
+    return {'sizes': sizes, 'seed_seconds': round(seed_seconds, 2), 'test_client': test_client,
+            'wsgi': {'clients': args.clients, 'seconds': args.seconds, 'routes': wsgi}}
+
+
+def ledger_worker(args):
+    sys.path.insert(0, ROOT)
+    from blockchain import Blockchain
+
+    def transactions(number):
+        return [Blockchain.make_transaction('bench', 'pharmacy', f'BENCH-{number:08d}-{offset}', 'Received')
+                for offset in range(args.block_transactions)]
+
+    # A chain at difficulty 1 is cheap to mine, so it can be long enough to validate meaningfully
+    blockchain = Blockchain(difficulty=1)
+    appends = []
+    for number in range(args.ledger_blocks):
+        proof = blockchain.proof_of_work(blockchain.last_block['proof'])
+        block_transactions = transactions(number)
+        started = perf_counter()
+        blockchain.new_block(proof, transactions=block_transactions)
+        appends.append(perf_counter() - started)
+
+    sample = [blockchain.chain[position] for position in random.sample(range(len(blockchain.chain)), min(1000, len(blockchain.chain)))]
+    hashes = time_calls(Blockchain.hash, sample)
+
+    started = perf_counter()
+    assert blockchain.validate_chain()
+    validate_seconds = perf_counter() - started
+    started = perf_counter()
+    assert blockchain.validate_chain(since=max(0, len(blockchain.chain) - 100))
+    validate_tail_seconds = perf_counter() - started
+
+    # Proof of work at the production difficulty, on the chain's own last proofs
+    miner = Blockchain(difficulty=args.difficulty)
+    proofs = time_calls(miner.proof_of_work, (block['proof'] for block in sample[:args.pow_samples]))
+    miner.close()
+    blockchain.close()
+
+    return {
+        'blocks': len(blockchain.chain),
+        'transactions_per_block': args.block_transactions,
+        'new_block': summarize(appends),
+        'hash': summarize(hashes),
+        'proof_of_work': dict(summarize(proofs), difficulty=args.difficulty),
+        'validate_chain': {
+            'seconds': round(validate_seconds, 3),
+            'blocks_per_second': round(len(blockchain.chain) / validate_seconds, 1),
+            'last_100_blocks_seconds': round(validate_tail_seconds, 4),
+        },
+    }
+
+
+def run_worker(suite, scale, args):
+    """
+    Runs one suite in a child process with its own database and ledger.
+    """
+    with tempfile.TemporaryDirectory(prefix='mediledger-bench-') as directory:
+        env = dict(os.environ,
+                   DATABASE_URL=f"sqlite:///{os.path.join(directory, 'bench.db')}",
+                   LEDGER_PATH=os.path.join(directory, 'ledger'),
+                   LEDGER_DIFFICULTY='1',
+                   UPLOAD_DIR=os.path.join(directory, 'uploads'),
+                   PASSWORD_HASH_MAX_WAIT_MS='60000',
+                   PASSWORD_HASH_MAX_PENDING='1000')
+        command = [sys.executable, os.path.abspath(__file__), '--worker', suite, '--scale', str(scale)]
+        for option in ('requests', 'clients', 'seconds', 'ledger_blocks', 'block_transactions', 'difficulty',
+                       'pow_samples'):
+            command += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+        completed = subprocess.run(command, env=env, cwd=directory, capture_output=True, text=True)
+        if completed.returncode:
+            return {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'failed'}
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suites', nargs='+', choices=SUITES, default=list(SUITES))
+    parser.add_argument('--scales', nargs='+', type=int, default=[10000, 100000, 1000000],
+                        help='Rows in the largest table of each app')
+    parser.add_argument('--requests', type=int, default=200, help='Sequential test-client requests per route')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent WSGI clients')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of the WSGI load test')
+    parser.add_argument('--ledger-blocks', type=int, default=10000)
+    parser.add_argument('--block-transactions', type=int, default=10)
+    parser.add_argument('--difficulty', type=int, default=4, help='Proof-of-work difficulty to time')
+    parser.add_argument('--pow-samples', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the request mix')
+    parser.add_argument('--output', help='Write the JSON results to this file as well')
+    parser.add_argument('--worker', choices=SUITES, help=argparse.SUPPRESS)
+    parser.add_argument('--scale', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    if args.worker:
+        if args.worker == 'ledger':
+            result = ledger_worker(args)
+        else:
+            result = (tracking_worker if args.worker == 'tracking' else prescriptions_worker)(args.scale, args)
+        print(json.dumps(result))
+        return
+
+    results = {'metadata': metadata(), 'settings': {key: value for key, value in vars(args).items()
+                                                    if key not in ('worker', 'scale', 'output')}}
+    for suite in args.suites:
+        if suite == 'ledger':
+            results['ledger'] = run_worker(suite, 0, args)
+        else:
+            results[suite] = {str(scale): run_worker(suite, scale, args) for scale in args.scales}
+        print(f'{suite} done', file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Synthetic data for the benchmarks, written straight into the SQLite file with
+executemany; going through the ORM would dominate the run time at 1M rows.
+The tables must already exist (db.create_all()).
+
+The scale is the number of rows in the largest table: TrackingHistory for the
+tracking app and Prescription for the prescription app.
+"""
+import sqlite3
+from datetime import date, datetime, timedelta
+
+# Every seeded account logs in with this password; the hash is deliberately
+# cheap so logging in does not dominate a load test.
+PASSWORD = 'benchmark'
+
+STATUSES = ('Manufactured', 'Ready for Transport', 'In Transit', 'Received', 'Dispensed')
+INSTRUCTIONS = ('Before Breakfast', 'After Lunch', 'After Dinner', 'As Needed')
+HISTORY_PER_PRODUCT = 10
+PRESCRIPTIONS_PER_PATIENT = 10
+ITEMS_PER_PRESCRIPTION = 2
+MEDICINES = 1000
+
+
+def password_hash():
+    from werkzeug.security import generate_password_hash
+    return generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+
+
+def _rows(connection, sql, rows, batch_size=50000):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            connection.executemany(sql, batch)
+            batch = []
+    if batch:
+        connection.executemany(sql, batch)
+
+
+def tracking_sizes(scale):
+    users_per_role = max(10, scale // 3000)
+    return {
+        'users_per_role': users_per_role,
+        'products': max(1, scale // HISTORY_PER_PRODUCT),
+        'history': scale,
+    }
+
+
+def batch_id(number):
+    return f'BENCH-{number:08d}'
+
+
+def seed_tracking(path, scale):
+    """
+    Users for each role, products and their tracking history. Accounts are
+    '<role>-<n>@bench' for n in range(users_per_role).
+    :return: Sizes of what was written
+    """
+    sizes = tracking_sizes(scale)
+    hashed = password_hash()
+    base = datetime(2024, 1, 1)
+    roles = ('manufacturer', 'distributor', 'pharmacy')
+    connection = sqlite3.connect(path)
+    with connection:
+        _rows(connection, 'INSERT INTO user (id, username, email, password, role) VALUES (?, ?, ?, ?, ?)',
+              ((index * sizes['users_per_role'] + number + 1, f'{role}-{number}', f'{role}-{number}@bench', hashed, role)
+               for index, role in enumerate(roles) for number in range(sizes['users_per_role'])))
+        _rows(connection, 'INSERT INTO product (id, name, batch_id, qr_code_path, manufacturer_id, created_at) '
+                          'VALUES (?, ?, ?, ?, ?, ?)',
+              ((number + 1, f'Product {number}', batch_id(number), f'qr/{batch_id(number)}.png',
+                number % sizes['users_per_role'] + 1, (base + timedelta(seconds=number)).isoformat(sep=' '))
+               for number in range(sizes['products'])))
+        _rows(connection, 'INSERT INTO tracking_history (product_id, status, timestamp, updated_by) VALUES (?, ?, ?, ?)',
+              ((row % sizes['products'] + 1, STATUSES[row // sizes['products'] % len(STATUSES)],
+                (base + timedelta(seconds=row)).isoformat(sep=' '), sizes['users_per_role'] + 1)
+               for row in range(sizes['history'])))
+    connection.close()
+    return sizes
+
+
+def prescription_sizes(scale):
+    return {
+        'doctors': max(10, scale // 1000),
+        'pharmacies': max(10, scale // 10000),
+        'patients': max(1, scale // PRESCRIPTIONS_PER_PATIENT),
+        'prescriptions': scale,
+        'medicines': MEDICINES,
+    }
+
+
+def patient_key(number):
+    return f'Patient {number}', date(1940, 1, 1) + timedelta(days=number % 25000)
+
+
+def seed_prescriptions(path, scale):
+    """
+    Doctors, pharmacies, medicines, patients, prescriptions and their line
+    items. Accounts are 'doctor-<n>@bench' and 'pharmacy-<n>@bench'; every
+    patient's prescriptions go to pharmacy 1 or 2.
+    :return: Sizes of what was written
+    """
+    sizes = prescription_sizes(scale)
+    hashed = password_hash()
+    base = datetime(2024, 1, 1)
+    connection = sqlite3.connect(path)
+    with connection:
+        _rows(connection, 'INSERT INTO doctor (id, name, hospital_name, contact_info, password_hash, id_proof, approved) '
+                          'VALUES (?, ?, ?, ?, ?, ?, 1)',
+              ((number + 1, f'Doctor {number}', 'General Hospital', f'doctor-{number}@bench', hashed, '-')
+               for number in range(sizes['doctors'])))
+        _rows(connection, 'INSERT INTO pharmacy (id, name, address, contact_info, password_hash) VALUES (?, ?, ?, ?, ?)',
+              ((number + 1, f'Pharmacy {number}', '-', f'pharmacy-{number}@bench', hashed)
+               for number in range(sizes['pharmacies'])))
+        _rows(connection, 'INSERT INTO medicine (id, name) VALUES (?, ?)',
+              ((number + 1, f'Medicine {number:04d}') for number in range(sizes['medicines'])))
+        _rows(connection, 'INSERT INTO patient (id, name, dob) VALUES (?, ?, ?)',
+              ((number + 1, *patient_key(number)) for number in range(sizes['patients'])))
+        _rows(connection, 'INSERT INTO prescription (id, patient_id, doctor_id, pharmacy_id, medicine_list, dosage, timestamp, fulfilled) '
+                          'VALUES (?, ?, ?, ?, ?, ?, ?, 0)',
+              ((row + 1, row % sizes['patients'] + 1, row % sizes['doctors'] + 1, row % 2 + 1,
+                f'Medicine {row % MEDICINES:04d} (As Needed)', '', (base + timedelta(seconds=row)).isoformat(sep=' '))
+               for row in range(sizes['prescriptions'])))
+        _rows(connection, 'INSERT INTO prescription_item (prescription_id, medicine_id, position, instructions) '
+                          'VALUES (?, ?, ?, ?)',
+              ((row + 1, (row + position) % MEDICINES + 1, position, INSTRUCTIONS[(row + position) % len(INSTRUCTIONS)])
+               for row in range(sizes['prescriptions']) for position in range(ITEMS_PER_PRESCRIPTION)))
+    connection.close()
+    return sizes
@@ -0,0 +1,119 @@
+"""
+Load test: concurrent distributor status updates against app.py.
+
+Runs the app on a local threaded WSGI server backed by a fresh SQLite file,
+once in the default rollback-journal mode and once with the WAL pragmas,
+and reports status-update throughput and latency for each.
+
+    python benchmarks/status_update_load.py --clients 16 --seconds 10
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.parse
+import urllib.request
+from time import perf_counter
+
+from common import ROOT, percentile
+
+
+def run_worker(clients, seconds, products):
+    # Imported here so DATABASE_URL and SQLITE_WAL are set first
+    sys.path.insert(0, ROOT)
+    from werkzeug.serving import make_server
+    from werkzeug.security import generate_password_hash
+    import app as tracking
+
+    with tracking.app.app_context():
+        password = generate_password_hash('load-test', method='pbkdf2:sha256:1000')
+        manufacturer = tracking.User(username='load-manufacturer', email='m@load', password=password, role='manufacturer')
+        tracking.db.session.add(manufacturer)
+        tracking.db.session.flush()
+        for client in range(clients):
+            tracking.db.session.add(tracking.User(username=f'load-distributor-{client}', email=f'd{client}@load',
+                                                  password=password, role='distributor'))
+        tracking.db.session.add_all([tracking.Product(name=f'Product {i}', batch_id=f'load-{i}', qr_code_path=f'qr/load-{i}.png',
+                                                      manufacturer_id=manufacturer.id) for i in range(products)])
+        tracking.db.session.commit()
+
+    server = make_server('127.0.0.1', 0, tracking.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = perf_counter() + seconds
+
+    def client(number):
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        login = urllib.parse.urlencode({'email': f'd{number}@load', 'password': 'load-test', 'role': 'distributor'}).encode()
+        opener.open(f'{base}/login', login).read()
+        update = 0
+        while perf_counter() < deadline:
+            form = urllib.parse.urlencode({'product_id': update % products + 1, 'status': 'Received'}).encode()
+            started = perf_counter()
+            try:
+                opener.open(f'{base}/distributor?limit=1', form).read()
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append(perf_counter() - started)
+            update += 1
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    started = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - started
+    server.shutdown()
+
+    return {
+        'updates': len(latencies),
+        'errors': errors[0],
+        'updates_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--products', type=int, default=100)
+    parser.add_argument('--worker', choices=['rollback', 'wal'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.clients, args.seconds, args.products)))
+        return
+
+    results = {}
+    for mode in ('rollback', 'wal'):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ,
+                       DATABASE_URL=f"sqlite:///{os.path.join(directory, 'load.db')}",
+                       SQLITE_WAL='1' if mode == 'wal' else '0',
+                       LEDGER_PATH=os.path.join(directory, 'ledger'),
+                       LEDGER_DIFFICULTY='1')
+            output = subprocess.run([sys.executable, __file__, '--worker', mode,
+                                     '--clients', str(args.clients), '--seconds', str(args.seconds),
+                                     '--products', str(args.products)],
+                                    env=env, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
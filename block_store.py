@@ -0,0 +1,283 @@
+import json
+import mmap
+import os
+import struct
+import threading
+
+from serialization import decode_block, encode_block
+
+
+class BlockStore:
+    """
+    Append-only, disk-backed storage for blockchain blocks.
+
+    Blocks are written as length-prefixed records, together with the
+    block's hash, to a segment file (``blocks.dat``) and the byte offset of every record is appended to an
+    index file (``blocks.idx``). Appending a block never rewrites earlier
+    data, and opening a store only reads the index and the last block.
+    Reads go through a memory map of the segment file.
+
+    The store behaves like a read-mostly list: it supports ``len()``,
+    integer indexing (including negative indexes), iteration and
+    ``append()``, so it can stand in for ``Blockchain.chain``.
+
+    One appender and any number of reader threads may share a store: the
+    memory map, the offsets and the cached tail block are only touched
+    under an internal lock, and payloads are copied out of the map before
+    they are decoded.
+    """
+
+    MAGIC = b'MLBS'
+    VERSION = 4
+    # Segments written before blocks were binary encoded hold JSON payloads,
+    # and version 3 segments hold binary blocks without a Merkle root. They
+    # can still be opened read-only and are upgraded by
+    # blockchain.migrate_store().
+    JSON_VERSION = 2
+    PRE_MERKLE_VERSION = 3
+    HEADER = struct.Struct('<4sB')
+    RECORD_HEADER = struct.Struct('<I32s')
+    INDEX_ENTRY = struct.Struct('<Q')
+    CHECKPOINT = struct.Struct('<Q')
+
+    def __init__(self, path, read_only=False):
+        """
+        Opens (or creates) a block store in the given directory.
+        :param path: Directory holding the segment and index files
+        :param read_only: Open an existing store without recovering or writing to it
+        """
+        self.path = path
+        self.read_only = read_only
+        self.data_path = os.path.join(path, 'blocks.dat')
+        self.index_path = os.path.join(path, 'blocks.idx')
+        self.checkpoint_path = os.path.join(path, 'checkpoint')
+
+        mode = 'rb' if read_only else 'a+b'
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+        self._data = open(self.data_path, mode)
+        self._index = open(self.index_path, mode)
+        self._map = None
+        # Guards _map, _offsets and the tail; remapping closes the old map
+        self._lock = threading.RLock()
+        self._offsets = []
+        self._tail = None
+        self._tail_hash = None
+        self.version = self.VERSION
+        self._checkpoint = self._read_checkpoint()
+
+        self._open_segment()
+        self._load_index()
+
+    def _open_segment(self):
+        self._data.seek(0, os.SEEK_END)
+        if self._data.tell() == 0 and not self.read_only:
+            self._data.write(self.HEADER.pack(self.MAGIC, self.VERSION))
+            self._data.flush()
+            return
+        self._data.seek(0)
+        magic, self.version = self.HEADER.unpack(self._data.read(self.HEADER.size))
+        if magic != self.MAGIC:
+            raise ValueError(f'{self.data_path} is not a block store segment')
+        if self.version in (self.JSON_VERSION, self.PRE_MERKLE_VERSION) and not self.read_only:
+            raise ValueError(f'{self.path} holds blocks in an older format; run blockchain.migrate_store() first')
+        if self.version not in (self.VERSION, self.JSON_VERSION, self.PRE_MERKLE_VERSION):
+            raise ValueError(f'Unsupported block store version {self.version}')
+
+    def _load_index(self):
+        self._index.seek(0)
+        raw = self._index.read()
+        entries = len(raw) // self.INDEX_ENTRY.size
+        self._offsets = [offset for (offset,) in self.INDEX_ENTRY.iter_unpack(raw[:entries * self.INDEX_ENTRY.size])]
+        if not self.read_only:
+            if len(raw) % self.INDEX_ENTRY.size:
+                # A torn index write: drop the partial entry.
+                self._index.truncate(entries * self.INDEX_ENTRY.size)
+            self._recover_tail()
+        self._remap()
+        if self._offsets:
+            self._tail, self._tail_hash = self._read(len(self._offsets) - 1)
+
+    def _recover_tail(self):
+        """
+        Re-indexes complete records written after the last index entry
+        (a crash between the data write and the index write) and drops a
+        trailing partial record.
+        """
+        self._data.seek(0, os.SEEK_END)
+        size = self._data.tell()
+        if self._offsets:
+            self._data.seek(self._offsets[-1])
+            length, _ = self.RECORD_HEADER.unpack(self._data.read(self.RECORD_HEADER.size))
+            end = self._offsets[-1] + self.RECORD_HEADER.size + length
+        else:
+            end = self.HEADER.size
+
+        while end + self.RECORD_HEADER.size <= size:
+            self._data.seek(end)
+            length, _ = self.RECORD_HEADER.unpack(self._data.read(self.RECORD_HEADER.size))
+            if end + self.RECORD_HEADER.size + length > size:
+                break
+            self._offsets.append(end)
+            self._index.write(self.INDEX_ENTRY.pack(end))
+            end += self.RECORD_HEADER.size + length
+        self._index.flush()
+
+        if end < size:
+            self._data.truncate(end)
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+        if not self.read_only:
+            self._data.flush()
+        self._map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_header(self, position):
+        # Callers hold self._lock
+        offset = self._offsets[position]
+        if offset + self.RECORD_HEADER.size > len(self._map):
+            self._remap()
+        length, digest = self.RECORD_HEADER.unpack_from(self._map, offset)
+        return offset + self.RECORD_HEADER.size, length, digest.hex()
+
+    def _read(self, position):
+        with self._lock:
+            start, length, block_hash = self._read_header(position)
+            if start + length > len(self._map):
+                self._remap()
+            payload = self._map[start:start + length]
+        if self.version == self.JSON_VERSION:
+            return json.loads(payload), block_hash
+        return decode_block(payload), block_hash
+
+    def _read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, 'rb') as f:
+                (checkpoint,) = self.CHECKPOINT.unpack(f.read(self.CHECKPOINT.size))
+                return checkpoint
+        except (FileNotFoundError, struct.error):
+            return 0
+
+    def append(self, block, block_hash):
+        """
+        Appends a block to the end of the segment file and records its offset.
+        :param block: Block
+        :param block_hash: SHA-256 hash of the Block, stored alongside it
+        """
+        if self.read_only:
+            raise ValueError('Block store is opened read-only')
+        payload = encode_block(block)
+        with self._lock:
+            self._data.seek(0, os.SEEK_END)
+            offset = self._data.tell()
+            self._data.write(self.RECORD_HEADER.pack(len(payload), bytes.fromhex(block_hash)) + payload)
+            self._data.flush()
+            self._index.write(self.INDEX_ENTRY.pack(offset))
+            self._index.flush()
+            self._offsets.append(offset)
+            self._tail, self._tail_hash = block, block_hash
+
+    def hash_at(self, position):
+        """
+        Returns the hash stored with a block without decoding the block.
+        :param position: Position of the block in the chain
+        :return: SHA-256 hash string
+        """
+        with self._lock:
+            position = self._position(position)
+            if position == len(self._offsets) - 1:
+                return self._tail_hash
+            return self._read_header(position)[2]
+
+    def items(self, start=0, stop=None):
+        """
+        Lazily yields (block, stored hash) pairs for a range of positions.
+        """
+        for position in range(*slice(start, stop).indices(len(self))):
+            yield self._item(position)
+
+    def _item(self, position):
+        with self._lock:
+            if position == len(self._offsets) - 1:
+                return self._tail, self._tail_hash
+        return self._read(position)
+
+    @property
+    def checkpoint(self):
+        """
+        Number of leading blocks known to be valid.
+        """
+        return self._checkpoint
+
+    @checkpoint.setter
+    def checkpoint(self, value):
+        temporary_path = self.checkpoint_path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(self.CHECKPOINT.pack(value))
+        os.replace(temporary_path, self.checkpoint_path)
+        self._checkpoint = value
+
+    def _position(self, position):
+        if position < 0:
+            position += len(self._offsets)
+        if not 0 <= position < len(self._offsets):
+            raise IndexError('block index out of range')
+        return position
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        return self._item(self._position(position))[0]
+
+    def __iter__(self):
+        for block, _ in self.items():
+            yield block
+
+    def sync(self):
+        """
+        Forces written blocks and index entries to stable storage.
+        """
+        self._data.flush()
+        os.fsync(self._data.fileno())
+        self._index.flush()
+        os.fsync(self._index.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._data.close()
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MemoryBlockStore(list):
+    """
+    In-memory counterpart of BlockStore with the same append/hash_at/items
+    interface, used when the Blockchain has no storage path.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.hashes = []
+        self.checkpoint = 0
+
+    def append(self, block, block_hash):
+        super().append(block)
+        self.hashes.append(block_hash)
+
+    def hash_at(self, position):
+        return self.hashes[position]
+
+    def items(self, start=0, stop=None):
+        return zip(self[start:stop], self.hashes[start:stop])
@@ -1,32 +1,67 @@
 import hashlib
 import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from time import time
 from datetime import datetime
 
+from block_store import BlockStore, MemoryBlockStore
+from mining import DEFAULT_DIFFICULTY, ProofOfWorkEngine, valid_proof
+from product_index import ProductIndex
+from merkle import merkle_proof, merkle_root, verify_proof
+from serialization import encode_header, encode_pre_merkle_block
+
+# Chains longer than this are split into segments of this many blocks for
+# parallel full validation.
+VALIDATION_SEGMENT_SIZE = 10000
+
 
 class Blockchain:
-    def __init__(self):
-        self.chain = []
+    def __init__(self, storage_path=None, difficulty=DEFAULT_DIFFICULTY, mining_workers=1):
+        """
+        :param storage_path: (Optional) Directory for a persistent block store.
+                             Without it the chain is kept in memory only.
+        :param difficulty: Number of leading hex zeroes a proof hash needs
+        :param mining_workers: Number of processes proof_of_work mines with;
+                               None uses every core
+        """
+        self.difficulty = difficulty
+        self.miner = ProofOfWorkEngine(difficulty, mining_workers)
+        self.chain = BlockStore(storage_path) if storage_path else MemoryBlockStore()
+        self.product_index = ProductIndex(os.path.join(storage_path, 'products.idx') if storage_path else None)
+        self.product_index.catch_up(self.chain)
         self.current_transactions = []
-        self.new_block(previous_hash='1', proof=100) 
+        # Guards appends to the chain, the product index and
+        # current_transactions. Block reads rely on the store's own locking,
+        # so proofs and exports do not wait for the sealer.
+        self._lock = threading.RLock()
+        if not self.chain:
+            self.new_block(previous_hash='1', proof=100)
 
-    def new_block(self, proof, previous_hash=None):
+    def new_block(self, proof, previous_hash=None, transactions=None):
         """
         Creates a new Block and adds it to the chain.
         :param proof: The proof given by the Proof of Work algorithm
         :param previous_hash: (Optional) Hash of the previous Block
+        :param transactions: (Optional) Transactions to seal instead of
+                             current_transactions, which are then left pending
         :return: New Block
         """
-        block = {
-            'index': len(self.chain) + 1,
-            'timestamp': str(datetime.now()),
-            'transactions': self.current_transactions,
-            'proof': proof,
-            'previous_hash': previous_hash or self.hash(self.chain[-1]),
-        }
+        with self._lock:
+            if transactions is None:
+                transactions, self.current_transactions = self.current_transactions, []
+            block = {
+                'index': len(self.chain) + 1,
+                'timestamp': str(datetime.now()),
+                'transactions': transactions,
+                'proof': proof,
+                'previous_hash': previous_hash or self.chain.hash_at(-1),
+                'merkle_root': merkle_root(transactions),
+            }
 
-        self.current_transactions = [] 
-        self.chain.append(block)  
+            self.chain.append(block, self.hash(block))
+            self.product_index.add_block(len(self.chain) - 1, block['transactions'])
         return block
 
     def new_transaction(self, sender, recipient, product_id, status):
@@ -38,44 +73,78 @@ class Blockchain:
         :param status: The current status of the product (Received, Ready for Transport)
         :return: The index of the block that will contain this transaction
         """
-        self.current_transactions.append({
+        transaction = self.make_transaction(sender, recipient, product_id, status)
+        with self._lock:
+            self.current_transactions.append(transaction)
+            return self.last_block['index'] + 1
+
+    @staticmethod
+    def make_transaction(sender, recipient, product_id, status):
+        """
+        Builds a transaction without queueing it.
+        :return: Transaction
+        """
+        return {
             'sender': sender,
             'recipient': recipient,
-            'product_id': product_id,
+            'product_id': str(product_id),
             'status': status,
             'timestamp': str(datetime.now())
-        })
+        }
 
-        return self.last_block['index'] + 1
+    def mine_block(self, transactions=None):
+        """
+        Runs proof of work on the last block and appends a new block. The
+        search runs without the chain lock, so transactions, reads and
+        validation are not blocked meanwhile; if another block was appended
+        during the search, it starts over on the new last block.
+        :param transactions: (Optional) Transactions to seal, see new_block
+        :return: New Block
+        """
+        while True:
+            with self._lock:
+                length, last_hash = len(self.chain), self.chain.hash_at(-1)
+                last_proof = self.last_block['proof']
+            proof = self.proof_of_work(last_proof)
+            with self._lock:
+                if len(self.chain) == length and self.chain.hash_at(-1) == last_hash:
+                    return self.new_block(proof, transactions=transactions)
 
     def proof_of_work(self, last_proof):
         """
         Simple Proof of Work Algorithm:
-        - Find a number p' such that hash(pp') contains 4 leading zeroes.
+        - Find a number p' such that hash(pp') contains `difficulty` leading zeroes.
         - p is the previous proof, and p' is the new proof.
+        The search runs on self.miner and can be stopped with self.miner.cancel().
         :param last_proof: Previous proof
         :return: New proof
         """
-        proof = 0
-        while self.valid_proof(last_proof, proof) is False:
-            proof += 1
-        return proof
+        return self.miner.mine(last_proof)
 
     def valid_proof(self, last_proof, proof):
         """
-        Validates the proof: Does hash(last_proof, proof) contain 4 leading zeroes?
+        Validates the proof: Does hash(last_proof, proof) contain `difficulty` leading zeroes?
         :param last_proof: Previous proof
         :param proof: Current proof
         :return: True if the proof is valid, False otherwise
         """
-        guess = f'{last_proof}{proof}'.encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
-        return guess_hash[:4] == "0000"
+        return valid_proof(last_proof, proof, self.difficulty)
 
     @staticmethod
     def hash(block):
         """
-        Creates a SHA-256 hash of a Block
+        Creates a SHA-256 hash of a Block's canonical binary header.
+        The transactions are covered through the header's Merkle root.
+        :param block: Block
+        :return: SHA-256 hash string
+        """
+        return hashlib.sha256(encode_header(block)).hexdigest()
+
+    @staticmethod
+    def legacy_hash(block):
+        """
+        Creates a SHA-256 hash of a Block in the original JSON form, used to
+        verify chains written before the binary encoding
         :param block: Block
         :return: SHA-256 hash string
         """
@@ -86,42 +155,246 @@ class Blockchain:
     def last_block(self):
         return self.chain[-1]
 
-    def validate_chain(self):
+    @property
+    def checkpoint(self):
+        """
+        Index of the last block known to be valid; blocks up to it are
+        skipped by validate_chain(since=blockchain.checkpoint).
+        """
+        return self.chain.checkpoint
+
+    def validate_chain(self, since=None, workers=None):
         """
         Check the validity of the chain.
+        Every checked block is rehashed and compared with the hash cached when
+        it was created, its Merkle root is recomputed, it is linked to the
+        cached hash of its predecessor and its proof is verified. On success the checkpoint advances to the last block.
+        :param since: (Optional) Index of the last trusted block, usually
+                      self.checkpoint; only later blocks are checked.
+                      Without it the whole chain is revalidated.
+        :param workers: (Optional) Number of processes for a full revalidation
         :return: True if the blockchain is valid, False otherwise
         """
-        last_block = self.chain[0]
-        current_index = 1
+        length = len(self.chain)
+        start = min(since or 0, length)
+        if since is None and length > VALIDATION_SEGMENT_SIZE and workers != 1:
+            valid = self._validate_parallel(workers)
+        else:
+            valid = _validate_segment(self.chain, start, length, self.difficulty)
 
-        while current_index < len(self.chain):
-            block = self.chain[current_index]
-            if block['previous_hash'] != self.hash(last_block):
-                return False
-            if not self.valid_proof(last_block['proof'], block['proof']):
-                return False
-            last_block = block
-            current_index += 1
+        if valid:
+            self.chain.checkpoint = length
+        return valid
+
+    def _validate_parallel(self, workers):
+        """
+        Revalidates the whole chain across a process pool, one task per
+        segment. Segments are linked through the cached hashes, so each one
+        can be checked independently.
+        """
+        length = len(self.chain)
+        bounds = [(start, min(start + VALIDATION_SEGMENT_SIZE, length))
+                  for start in range(0, length, VALIDATION_SEGMENT_SIZE)]
+        if isinstance(self.chain, BlockStore):
+            self.chain.sync()
+            tasks = [(self.chain.path, start, stop) for start, stop in bounds]
+        else:
+            tasks = [_memory_segment(self.chain, start, stop) for start, stop in bounds]
+
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = [pool.submit(_validate_segment, *task, self.difficulty) for task in tasks]
+            return all(future.result() for future in futures)
+
+    def prove_transaction(self, product_id, status):
+        """
+        Builds an inclusion proof for the latest transaction recording
+        product_id reaching status. The proof holds the block header rather
+        than the whole block, so it stays O(log n) in the block's size.
+        :param product_id: Product ID for tracking
+        :param status: The status recorded by the transaction
+        :return: Proof dictionary, or None if no such transaction exists
+        """
+        with self._lock:
+            locations = self.product_index.get(str(product_id))
+        for position, offset in reversed(locations):
+            block = self.chain[position]
+            if block['transactions'][offset]['status'] == status:
+                return self._transaction_proof(position, block, offset)
+        return None
+
+    def _transaction_proof(self, position, block, offset):
+        header = {key: value for key, value in block.items() if key != 'transactions'}
+        return {
+            'transaction': block['transactions'][offset],
+            'block': header,
+            'block_hash': self.chain.hash_at(position),
+            'merkle_proof': merkle_proof(block['transactions'], offset),
+        }
+
+    @staticmethod
+    def verify_transaction_proof(proof):
+        """
+        Checks a proof from prove_transaction: the transaction must hash up
+        to the header's Merkle root and the header to the claimed block hash.
+        Callers should still compare block_hash with a block hash they trust.
+        :param proof: Proof dictionary
+        :return: True if the proof is valid, False otherwise
+        """
+        header = proof['block']
+        return (verify_proof(proof['transaction'], proof['merkle_proof'], header['merkle_root'])
+                and Blockchain.hash(header) == proof['block_hash'])
+
+    def transactions_for(self, product_id):
+        """
+        Streams every transaction recorded for a product, oldest first,
+        using the product index instead of scanning the chain.
+        :param product_id: Product ID for tracking
+        :return: Generator of transactions
+        """
+        with self._lock:
+            locations = self.product_index.get(str(product_id))
+        block_position, block = None, None
+        for position, offset in locations:
+            if position != block_position:
+                block_position, block = position, self.chain[position]
+            yield block['transactions'][offset]
+
+    def rebuild_product_index(self):
+        """
+        Rebuilds the product index from the chain.
+        """
+        with self._lock:
+            self.product_index.rebuild(self.chain)
 
-        return True
+    def close(self):
+        """
+        Releases the block store, the product index and the mining pool.
+        """
+        with self._lock:
+            if isinstance(self.chain, BlockStore):
+                self.chain.close()
+            self.product_index.close()
+            self.miner.close()
 
-    def get_blockchain_data(self):
+    def get_blockchain_data(self, start=0):
         """
-        Returns the entire blockchain data as a list of dictionaries
-        :return: List of blocks
+        Streams the blockchain data one block at a time
+        :param start: (Optional) Number of leading blocks to skip
+        :return: Generator of blocks
         """
-        blockchain_data = []
-        for block in self.chain:
-            block_data = {
+        for block, _ in self.chain.items(start):
+            yield {
                 'index': block['index'],
                 'timestamp': block['timestamp'],
                 'transactions': block['transactions'],
                 'proof': block['proof'],
                 'previous_hash': block['previous_hash'],
+                'merkle_root': block['merkle_root'],
             }
-            blockchain_data.append(block_data)
 
-        return blockchain_data
+
+def _memory_segment(chain, start, stop):
+    """
+    Copies the blocks and cached hashes a worker needs to check chain[start:stop].
+    :return: (segment, start, stop) with the positions rebased onto the segment
+    """
+    offset = max(start - 1, 0)
+    segment = MemoryBlockStore()
+    for block, block_hash in chain.items(offset, stop):
+        segment.append(block, block_hash)
+    return segment, start - offset, stop - offset
+
+
+def _validate_segment(chain, start, stop, difficulty=DEFAULT_DIFFICULTY):
+    """
+    Checks chain[start:stop] against the cached hashes.
+    :param chain: Block store, MemoryBlockStore or the path of a block store
+    :param difficulty: Proof of work difficulty the chain was mined with
+    :return: True if the segment is valid, False otherwise
+    """
+    if isinstance(chain, str):
+        with BlockStore(chain, read_only=True) as store:
+            return _validate_segment(store, start, stop, difficulty)
+
+    previous = None
+    if start > 0:
+        previous = (chain[start - 1], chain.hash_at(start - 1))
+    for block, cached_hash in chain.items(start, stop):
+        if Blockchain.hash(block) != cached_hash:
+            return False
+        if merkle_root(block['transactions']) != block['merkle_root']:
+            return False
+        if previous is not None:
+            last_block, last_hash = previous
+            if block['previous_hash'] != last_hash:
+                return False
+            if not valid_proof(last_block['proof'], block['proof'], difficulty):
+                return False
+        previous = (block, cached_hash)
+    return True
+
+
+def pre_merkle_hash(block):
+    """
+    Creates a SHA-256 hash of a Block in binary format 1, used to verify
+    chains written before blocks had a Merkle root
+    :param block: Block
+    :return: SHA-256 hash string
+    """
+    return hashlib.sha256(encode_pre_merkle_block(block)).hexdigest()
+
+
+def migrate_legacy_chain(blocks, legacy_hash=Blockchain.legacy_hash):
+    """
+    Re-seals a chain hashed in an older form under the current encoding.
+    The legacy links are verified first; each block then gets a Merkle root
+    and its previous_hash rewritten to the current hash of its predecessor.
+    :param blocks: Iterable of blocks, genesis first
+    :param legacy_hash: Hash function the chain was linked with,
+                        Blockchain.legacy_hash or pre_merkle_hash
+    :return: Generator of (block, hash) pairs
+    :raises ValueError: if the legacy chain is broken
+    """
+    legacy_previous = None
+    previous_hash = None
+    for block in blocks:
+        if legacy_previous is not None and block['previous_hash'] != legacy_previous:
+            raise ValueError(f"Legacy chain is broken at block {block['index']}")
+        legacy_previous = legacy_hash(block)
+
+        block = dict(block, transactions=[dict(transaction, product_id=str(transaction['product_id']))
+                                          for transaction in block['transactions']])
+        block['merkle_root'] = merkle_root(block['transactions'])
+        if previous_hash is not None:
+            block['previous_hash'] = previous_hash
+        previous_hash = Blockchain.hash(block)
+        yield block, previous_hash
+
+
+def migrate_store(path):
+    """
+    Upgrades a block store with JSON-encoded blocks, or binary blocks
+    without a Merkle root, to the current format in place. The old store is
+    kept next to it with a .json or .v3 suffix.
+    :param path: Directory of the block store
+    :return: True if the store was migrated, False if it was already current
+    """
+    with BlockStore(path, read_only=True) as legacy:
+        if legacy.version == BlockStore.VERSION:
+            return False
+        if legacy.version == BlockStore.JSON_VERSION:
+            legacy_hash, suffix = Blockchain.legacy_hash, '.json'
+        else:
+            legacy_hash, suffix = pre_merkle_hash, '.v3'
+        migrated_path = path + '.migrating'
+        with BlockStore(migrated_path) as store:
+            for block, block_hash in migrate_legacy_chain(legacy, legacy_hash):
+                store.append(block, block_hash)
+            store.sync()
+
+    os.replace(path, path + suffix)
+    os.replace(migrated_path, path)
+    return True
 
 
 # Example Usage:
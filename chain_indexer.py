@@ -0,0 +1,297 @@
+import json
+import re
+import urllib.request
+from collections import namedtuple
+from itertools import count
+
+# keccak256("ProductUpdated(string,string,bool)"), topic 0 of every
+# ProductUpdated log emitted by truffle/contracts/Tracking.sol
+PRODUCT_UPDATED_TOPIC = '0x7c04a222f9f64cfd5b6f6ffa6ff5290248625300382234a5859d0b2bfc71bff2'
+
+# One decoded ProductUpdated log.
+ChainEvent = namedtuple('ChainEvent', ['block_number', 'block_hash', 'log_index', 'transaction_hash',
+                                       'product_id', 'location', 'delivered'])
+
+
+# JSON-RPC error code and messages nodes use to refuse an eth_getLogs query
+# as too large, e.g. "query returned more than 10000 results" or "block range
+# is too wide"
+LIMIT_EXCEEDED_CODE = -32005
+LIMIT_EXCEEDED_MESSAGE = re.compile(r'limit exceeded|too many|more than \d+ results|block range|range is too'
+                                    r'|response size', re.IGNORECASE)
+
+
+class RpcError(Exception):
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+    @property
+    def limit_exceeded(self):
+        """
+        True if the node refused the request as too large, so a smaller one may succeed.
+        """
+        return self.code == LIMIT_EXCEEDED_CODE or bool(LIMIT_EXCEEDED_MESSAGE.search(str(self)))
+
+
+class JsonRpcClient:
+    """
+    Minimal Ethereum JSON-RPC client over HTTP.
+    """
+
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+        self._ids = count(1)
+
+    def call(self, method, *params):
+        payload = json.dumps({'jsonrpc': '2.0', 'id': next(self._ids), 'method': method, 'params': list(params)})
+        request = urllib.request.Request(self.url, payload.encode(), {'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            reply = json.loads(response.read())
+        if reply.get('error'):
+            error = reply['error']
+            raise RpcError(error.get('message', error), error.get('code'))
+        return reply['result']
+
+    def block_number(self):
+        return int(self.call('eth_blockNumber'), 16)
+
+    def block_hash(self, number):
+        block = self.call('eth_getBlockByNumber', hex(number), False)
+        return block['hash'] if block else None
+
+    def get_logs(self, address, topic, from_block, to_block):
+        return self.call('eth_getLogs', {'address': address, 'topics': [topic],
+                                         'fromBlock': hex(from_block), 'toBlock': hex(to_block)})
+
+
+def _word(data, position):
+    return data[position * 32:(position + 1) * 32]
+
+
+def _abi_string(data, offset):
+    length = int.from_bytes(data[offset:offset + 32], 'big')
+    return data[offset + 32:offset + 32 + length].decode('utf-8')
+
+
+def decode_product_updated(log):
+    """
+    Decodes the non-indexed (string productId, string location, bool delivered)
+    arguments of a ProductUpdated log.
+    :param log: Log object as returned by eth_getLogs
+    :return: ChainEvent
+    """
+    data = bytes.fromhex(log['data'][2:])
+    return ChainEvent(
+        block_number=int(log['blockNumber'], 16),
+        block_hash=log['blockHash'],
+        log_index=int(log['logIndex'], 16),
+        transaction_hash=log['transactionHash'],
+        product_id=_abi_string(data, int.from_bytes(_word(data, 0), 'big')),
+        location=_abi_string(data, int.from_bytes(_word(data, 1), 'big')),
+        delivered=bool(int.from_bytes(_word(data, 2), 'big')),
+    )
+
+
+class ChainIndexer:
+    """
+    Mirrors the contract's ProductUpdated events into a store.
+
+    Logs are fetched with eth_getLogs over block ranges of up to batch_size
+    blocks, halving the range whenever the node refuses it as too large. After
+    each range the store records its events, the products' latest state and the
+    hash of the range's last block as the checkpoint. A run first compares the
+    checkpoint hash with the chain; if the block was replaced by a reorg the
+    store is rolled back reorg_depth blocks and those blocks are indexed again.
+    Blocks younger than `confirmations` are left for a later run.
+    """
+
+    def __init__(self, rpc, address, store, batch_size=2000, reorg_depth=12, confirmations=0, start_block=0):
+        """
+        :param rpc: JsonRpcClient or compatible object
+        :param address: Contract address
+        :param store: SqlChainStore, MemoryChainStore or compatible object
+        :param batch_size: Largest block range per eth_getLogs call
+        :param reorg_depth: Blocks to roll back when the checkpoint block was reorganized away
+        :param confirmations: Blocks to stay behind the head
+        :param start_block: First block to index, e.g. the contract's deployment block
+        """
+        self.rpc = rpc
+        self.address = address
+        self.store = store
+        self.batch_size = batch_size
+        self.reorg_depth = reorg_depth
+        self.confirmations = confirmations
+        self.start_block = start_block
+
+    def run(self):
+        """
+        Indexes everything between the checkpoint and the confirmed head.
+        :return: Dictionary with the block range covered, events stored and
+                 blocks rolled back
+        """
+        report = {'rolled_back_to': None, 'from_block': None, 'to_block': None, 'events': 0}
+        checkpoint = self.store.checkpoint()
+        if checkpoint is not None:
+            number, block_hash = checkpoint
+            if self.rpc.block_hash(number) != block_hash:
+                # Blocks older than reorg_depth are assumed final
+                rollback_to = max(self.start_block - 1, number - self.reorg_depth)
+                self.store.rollback(rollback_to, self.rpc.block_hash(rollback_to) if rollback_to >= 0 else None)
+                report['rolled_back_to'] = rollback_to
+                checkpoint = self.store.checkpoint()
+
+        start = checkpoint[0] + 1 if checkpoint else self.start_block
+        head = self.rpc.block_number() - self.confirmations
+        if start > head:
+            return report
+        report['from_block'] = start
+
+        batch_size = self.batch_size
+        while start <= head:
+            stop = min(start + batch_size - 1, head)
+            try:
+                logs = self.rpc.get_logs(self.address, PRODUCT_UPDATED_TOPIC, start, stop)
+            except RpcError as error:
+                # Nodes cap the size of a log query; retry with a smaller range
+                if not error.limit_exceeded or stop == start:
+                    raise
+                batch_size = max(1, (stop - start + 1) // 2)
+                continue
+            events = [decode_product_updated(log) for log in logs if not log.get('removed')]
+            events.sort(key=lambda event: (event.block_number, event.log_index))
+            self.store.apply(events, stop, self.rpc.block_hash(stop))
+            report['events'] += len(events)
+            report['to_block'] = stop
+            start = stop + 1
+        return report
+
+
+def latest_per_product(events):
+    """
+    :param events: ChainEvents in chain order
+    :return: Dictionary of product_id -> its last event
+    """
+    return {event.product_id: event for event in events}
+
+
+class MemoryChainStore:
+    """
+    In-memory store with the same interface as SqlChainStore, for tests and tools.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.products = {}
+        self._checkpoint = None
+
+    def checkpoint(self):
+        return self._checkpoint
+
+    def apply(self, events, block_number, block_hash):
+        self.events.extend(events)
+        self.products.update(latest_per_product(events))
+        self._checkpoint = (block_number, block_hash)
+
+    def rollback(self, block_number, block_hash):
+        self.events = [event for event in self.events if event.block_number <= block_number]
+        self.products = latest_per_product(self.events)
+        self._checkpoint = (block_number, block_hash) if block_hash else None
+
+
+class SqlChainStore:
+    """
+    Keeps the indexed events, each product's current on-chain state and the
+    checkpoint in SQL tables, so the app can serve on-chain state without RPC.
+    """
+
+    def __init__(self, db, event_model, product_model, checkpoint_model, contract):
+        """
+        :param db: Flask-SQLAlchemy extension
+        :param event_model: Model with the ChainEvent columns, unique on (block_number, log_index)
+        :param product_model: Model keyed by product_id with location, delivered,
+                              block_number and log_index columns
+        :param checkpoint_model: Model keyed by contract with block_number and block_hash columns
+        :param contract: Contract address the checkpoint belongs to
+        """
+        self.db = db
+        self.event_model = event_model
+        self.product_model = product_model
+        self.checkpoint_model = checkpoint_model
+        self.contract = contract.lower()
+        self.chunk_size = 500
+
+    def checkpoint(self):
+        row = self.db.session.get(self.checkpoint_model, self.contract)
+        return (row.block_number, row.block_hash) if row else None
+
+    def apply(self, events, block_number, block_hash):
+        """
+        Stores one range's events, upserts the products they touch and moves
+        the checkpoint, all in one transaction.
+        """
+        session = self.db.session
+        event_rows = [event._asdict() for event in events]
+        product_rows = [{'product_id': event.product_id, 'location': event.location, 'delivered': event.delivered,
+                         'block_number': event.block_number, 'log_index': event.log_index}
+                        for event in latest_per_product(events).values()]
+        # Chunked to stay under the database's bound-parameter limit
+        for start in range(0, len(event_rows), self.chunk_size):
+            session.execute(self._insert(self.event_model, event_rows[start:start + self.chunk_size],
+                                         ['block_number', 'log_index'], update=False))
+        for start in range(0, len(product_rows), self.chunk_size):
+            session.execute(self._insert(self.product_model, product_rows[start:start + self.chunk_size],
+                                         ['product_id'], update=True))
+        session.merge(self.checkpoint_model(contract=self.contract, block_number=block_number, block_hash=block_hash))
+        session.commit()
+
+    def rollback(self, block_number, block_hash):
+        """
+        Deletes events after block_number and rebuilds the state of the
+        products they touched from the events that remain.
+        :param block_hash: Current hash of block_number, the new checkpoint;
+                           None removes the checkpoint
+        """
+        session = self.db.session
+        events = self.event_model
+        affected = [product_id for product_id, in session.execute(
+            self.db.select(events.product_id).where(events.block_number > block_number).distinct())]
+        session.execute(self.db.delete(events).where(events.block_number > block_number))
+        for product_id in affected:
+            latest = session.execute(self.db.select(events).where(events.product_id == product_id)
+                                     .order_by(events.block_number.desc(), events.log_index.desc())
+                                     .limit(1)).scalar()
+            product = session.get(self.product_model, product_id)
+            if latest is None:
+                if product is not None:
+                    session.delete(product)
+            else:
+                product.location = latest.location
+                product.delivered = latest.delivered
+                product.block_number = latest.block_number
+                product.log_index = latest.log_index
+        if block_hash is None:
+            session.execute(self.db.delete(self.checkpoint_model).where(self.checkpoint_model.contract == self.contract))
+        else:
+            session.merge(self.checkpoint_model(contract=self.contract, block_number=block_number, block_hash=block_hash))
+        session.commit()
+
+    def _insert(self, model, rows, conflict_columns, update):
+        """
+        Multi-row INSERT ... ON CONFLICT on SQLite and PostgreSQL.
+        """
+        dialect = self.db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            raise RuntimeError(f'The chain index needs SQLite or PostgreSQL, not {dialect}')
+        statement = insert(model).values(rows)
+        if not update:
+            return statement.on_conflict_do_nothing(index_elements=conflict_columns)
+        columns = [column for column in rows[0] if column not in conflict_columns]
+        return statement.on_conflict_do_update(index_elements=conflict_columns,
+                                               set_={column: statement.excluded[column] for column in columns})
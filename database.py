@@ -0,0 +1,103 @@
+import os
+import sqlite3
+
+from sqlalchemy import case, event, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+
+def configure_database(app, default_url):
+    """
+    Reads the database settings shared by both apps into app.config:
+    DATABASE_URL selects the engine (SQLite by default, PostgreSQL in
+    production), DB_POOL_* size the connection pool and SQLITE_* tune SQLite.
+    :param default_url: SQLite URL used when DATABASE_URL is not set
+    """
+    database_url = os.environ.get('DATABASE_URL', default_url)
+    if database_url.startswith('postgres://'):
+        database_url = 'postgresql://' + database_url[len('postgres://'):]
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if database_url not in ('sqlite://', 'sqlite:///:memory:'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': True,
+        }
+    app.config['SQLITE_WAL'] = os.environ.get('SQLITE_WAL', '1') == '1'
+    app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+
+def set_sqlite_pragmas(app, engine):
+    """
+    SQLite: WAL lets readers run alongside the single writer, synchronous=NORMAL
+    skips the fsync per commit that WAL does not need, and the busy timeout makes
+    concurrent writers wait for the lock instead of failing. Applied to every
+    new connection of engine; other databases are left alone.
+    """
+    @event.listens_for(engine, 'connect')
+    def apply_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']}")
+        if app.config['SQLITE_WAL']:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute(f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}")
+        cursor.close()
+
+
+def create_missing_indexes(db):
+    """
+    create_all() only creates indexes together with new tables, so add any
+    index missing from an existing database.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def dialect_insert(db, model):
+    """
+    :return: Insert construct supporting on_conflict_*, or None if the
+             database has no ON CONFLICT clause
+    """
+    insert_for = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}.get(db.engine.dialect.name)
+    return insert_for(model) if insert_for else None
+
+
+def add_to_aggregate(db, model, keys, sums=None, maximums=None):
+    """
+    One INSERT ... ON CONFLICT DO UPDATE where the database has it, so
+    concurrent updates of the same row add up instead of overwriting each
+    other; elsewhere an UPDATE, then an INSERT if the row does not exist yet.
+    Does not commit.
+    :param keys: Primary key values of the row
+    :param sums: (Optional) Columns to add to
+    :param maximums: (Optional) Columns keeping the largest value seen
+    """
+    sums, maximums = sums or {}, maximums or {}
+    statement = dialect_insert(db, model)
+    if statement is None:
+        updates = {column: getattr(model, column) + amount for column, amount in sums.items()}
+        updates.update({column: case((getattr(model, column) < value, value), else_=getattr(model, column))
+                        for column, value in maximums.items()})
+        if db.session.execute(update(model).filter_by(**keys).values(updates)).rowcount:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(model).values(**keys, **sums, **maximums))
+        except IntegrityError:
+            # Another transaction inserted the row first
+            db.session.execute(update(model).filter_by(**keys).values(updates))
+        return
+    statement = statement.values(**keys, **sums, **maximums)
+    excluded = statement.excluded
+    updates = {column: getattr(model, column) + excluded[column] for column in sums}
+    updates.update({column: case((excluded[column] > getattr(model, column), excluded[column]),
+                                 else_=getattr(model, column))
+                    for column in maximums})
+    db.session.execute(statement.on_conflict_do_update(index_elements=list(keys), set_=updates))
@@ -0,0 +1,70 @@
+import threading
+
+from response_cache import Invalidations, LRUCacheBackend
+
+
+class IdentityCache:
+    """
+    Per-process cache of detached ORM objects keyed by primary key, used to
+    load the logged-in user without a query on every request.
+
+    Cached objects are never attached to a session. Callers get a
+    session-bound copy with session.merge(obj, load=False), which copies the
+    cached state without emitting SQL and leaves the cached object untouched,
+    so one entry can serve any number of threads. Like ResponseCache, set()
+    takes the generation() read before the object was loaded and drops the
+    object if its key was invalidated in between.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60):
+        """
+        :param max_entries: Maximum number of cached objects
+        :param ttl: Seconds an entry may live, bounding staleness when a change
+                    is made by another process
+        """
+        self.ttl = ttl
+        self._backend = LRUCacheBackend(max_entries)
+        self._lock = threading.Lock()
+        self._invalidations = Invalidations()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.discarded = 0
+
+    def generation(self):
+        return self._invalidations.generation()
+
+    def get(self, key):
+        obj = self._backend.get(key)
+        with self._lock:
+            if obj is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return obj
+
+    def set(self, key, obj, generation):
+        """
+        :param obj: Detached object with all the attributes callers need loaded
+        :param generation: generation() taken before obj was loaded
+        """
+        if not self._invalidations.store(key, generation, lambda: self._backend.set(key, obj, self.ttl)):
+            with self._lock:
+                self.discarded += 1
+
+    def invalidate(self, key):
+        self._invalidations.invalidate(key, self._backend.delete)
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._backend),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'invalidations': self.invalidations,
+                'discarded': self.discarded,
+            }
@@ -0,0 +1,212 @@
+import cProfile
+import functools
+import os
+import random
+import threading
+from collections import defaultdict
+from time import perf_counter, strftime
+
+from flask import Response, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Instrumentation:
+    """
+    Opt-in per-request timing for a Flask app, exported at /metrics in the
+    Prometheus text format.
+
+    Every request's wall time is recorded per endpoint and split into the
+    components that ran in the request thread: SQL (timed with the
+    before/after_cursor_execute engine events, with a query count), template
+    rendering (Flask's template signals) and anything wrapped with
+    instrument(), such as QR rendering and password hashing. Work outside
+    requests, like mining in the ledger thread, is timed with sample(), which
+    only measures a fraction of the calls.
+
+    A request carrying the header X-Profile: <profile_token> also runs
+    under cProfile, and its stats are written to profile_dir. The response
+    names the file in X-Profile-File.
+    """
+
+    def __init__(self, app, namespace, profile_dir=None, profile_token=None):
+        """
+        :param app: Flask app to instrument
+        :param namespace: Prefix of the exported metric names
+        :param profile_dir: (Optional) Directory for cProfile dumps
+        :param profile_token: (Optional) Value of the X-Profile header that
+                              enables profiling; without it profiling is off
+        """
+        self.namespace = namespace
+        self.profile_dir = profile_dir
+        self.profile_token = profile_token
+        self._lock = threading.Lock()
+        self._requests = defaultdict(int)        # (endpoint, method, status) -> count
+        self._latency = {}                       # endpoint -> [bucket counts..., sum, count]
+        self._components = defaultdict(float)    # (endpoint, component) -> seconds
+        self._queries = defaultdict(int)         # endpoint -> SQL statements
+        self._samples = defaultdict(lambda: [0, 0.0])  # operation -> [count, seconds]
+        self._sample_rates = {}
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_template, app)
+        template_rendered.connect(self._after_template, app)
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    # Timing inside requests
+
+    def add(self, component, seconds):
+        """
+        Charges seconds of work to component for the current request.
+        """
+        if has_request_context() and 'instrumentation' in g:
+            timings = g.instrumentation
+            timings[component] = timings.get(component, 0.0) + seconds
+
+    def instrument(self, obj, method, component):
+        """
+        Replaces obj.method with a wrapper charging its run time to component.
+        """
+        original = getattr(obj, method)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.add(component, perf_counter() - started)
+
+        setattr(obj, method, timed)
+
+    def _before_request(self):
+        g.instrumentation = {}
+        g.instrumentation_queries = 0
+        g.instrumentation_started = perf_counter()
+        if self.profile_token and self.profile_dir and request.headers.get('X-Profile') == self.profile_token:
+            g.instrumentation_profile = cProfile.Profile()
+            g.instrumentation_profile.enable()
+
+    def _after_request(self, response):
+        if 'instrumentation_started' not in g:
+            return response
+        elapsed = perf_counter() - g.instrumentation_started
+        endpoint = request.endpoint or 'unmatched'
+        profile = g.pop('instrumentation_profile', None)
+        if profile is not None:
+            profile.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{endpoint}-{strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident()}.prof")
+            profile.dump_stats(path)
+            response.headers['X-Profile-File'] = os.path.basename(path)
+
+        with self._lock:
+            self._requests[endpoint, request.method, response.status_code] += 1
+            histogram = self._latency.setdefault(endpoint, [0] * len(BUCKETS) + [0.0, 0])
+            for position, bound in enumerate(BUCKETS):
+                if elapsed <= bound:
+                    histogram[position] += 1
+            histogram[-2] += elapsed
+            histogram[-1] += 1
+            for component, seconds in g.instrumentation.items():
+                self._components[endpoint, component] += seconds
+            self._queries[endpoint] += g.instrumentation_queries
+        return response
+
+    def _before_template(self, sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault('instrumentation_templates', []).append(perf_counter())
+
+    def _after_template(self, sender, template, context, **extra):
+        if has_request_context() and g.get('instrumentation_templates'):
+            self.add('template', perf_counter() - g.instrumentation_templates.pop())
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.instrumentation_started = perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, 'instrumentation_started', None)
+        if started is not None and has_request_context() and 'instrumentation' in g:
+            self.add('sql', perf_counter() - started)
+            g.instrumentation_queries += 1
+
+    # Sampled timing outside requests
+
+    def sample(self, obj, method, operation, rate=0.1):
+        """
+        Replaces obj.method with a wrapper timing a random fraction of its calls.
+        :param rate: Fraction of calls timed
+        """
+        original = getattr(obj, method)
+        self._sample_rates[operation] = rate
+
+        @functools.wraps(original)
+        def sampled(*args, **kwargs):
+            if random.random() >= rate:
+                return original(*args, **kwargs)
+            started = perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - started
+                with self._lock:
+                    totals = self._samples[operation]
+                    totals[0] += 1
+                    totals[1] += elapsed
+
+        setattr(obj, method, sampled)
+
+    # Export
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+    def render(self):
+        """
+        :return: All metrics in the Prometheus text exposition format
+        """
+        prefix = self.namespace
+        lines = []
+        with self._lock:
+            lines += [f'# HELP {prefix}_requests_total Requests handled, by endpoint, method and status.',
+                      f'# TYPE {prefix}_requests_total counter']
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'{prefix}_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            lines += [f'# HELP {prefix}_request_duration_seconds Request wall time by endpoint.',
+                      f'# TYPE {prefix}_request_duration_seconds histogram']
+            for endpoint, histogram in sorted(self._latency.items()):
+                for bound, count in zip(BUCKETS, histogram):
+                    lines.append(f'{prefix}_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                lines.append(f'{prefix}_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {histogram[-1]}')
+                lines.append(f'{prefix}_request_duration_seconds_sum{{endpoint="{endpoint}"}} {histogram[-2]:.6f}')
+                lines.append(f'{prefix}_request_duration_seconds_count{{endpoint="{endpoint}"}} {histogram[-1]}')
+
+            lines += [f'# HELP {prefix}_request_component_seconds_total Request time spent in SQL, templates, QR rendering and password hashing.',
+                      f'# TYPE {prefix}_request_component_seconds_total counter']
+            for (endpoint, component), seconds in sorted(self._components.items()):
+                lines.append(f'{prefix}_request_component_seconds_total{{endpoint="{endpoint}",component="{component}"}} {seconds:.6f}')
+
+            lines += [f'# HELP {prefix}_sql_queries_total SQL statements executed while handling requests.',
+                      f'# TYPE {prefix}_sql_queries_total counter']
+            for endpoint, count in sorted(self._queries.items()):
+                lines.append(f'{prefix}_sql_queries_total{{endpoint="{endpoint}"}} {count}')
+
+            lines += [f'# HELP {prefix}_sampled_operation_seconds Time of sampled background operations.',
+                      f'# TYPE {prefix}_sampled_operation_seconds summary']
+            for operation, (count, seconds) in sorted(self._samples.items()):
+                lines.append(f'{prefix}_sampled_operation_seconds_sum{{operation="{operation}"}} {seconds:.6f}')
+                lines.append(f'{prefix}_sampled_operation_seconds_count{{operation="{operation}"}} {count}')
+            lines += [f'# HELP {prefix}_sample_rate Fraction of calls timed per sampled operation.',
+                      f'# TYPE {prefix}_sample_rate gauge']
+            for operation, rate in sorted(self._sample_rates.items()):
+                lines.append(f'{prefix}_sample_rate{{operation="{operation}"}} {rate}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import socket
+import threading
+from collections import deque
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+
+class LocalBroker:
+    """
+    In-process pub/sub: publish() hands messages straight to the listener.
+    Only correct when the app runs in a single process.
+    """
+
+    def __init__(self):
+        self._listener = None
+
+    def listen(self, callback):
+        self._listener = callback
+
+    def publish(self, channels, event_id, data):
+        if self._listener is not None:
+            self._listener(channels, event_id, data)
+
+
+class RedisBroker:
+    """
+    Relays messages through one Redis pub/sub channel, so every worker
+    process's event server sees what any process publishes.
+    """
+
+    def __init__(self, client, channel='mediledger:live'):
+        self.client = client
+        self.channel = channel
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis  # optional dependency, only needed for this broker
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def listen(self, callback):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+
+        def relay():
+            for item in pubsub.listen():
+                message = json.loads(item['data'])
+                callback(message['channels'], message['id'], message['data'])
+
+        threading.Thread(target=relay, name='live-updates-relay', daemon=True).start()
+
+    def publish(self, channels, event_id, data):
+        self.client.publish(self.channel, json.dumps({'channels': channels, 'id': event_id, 'data': data}, default=str))
+
+
+class LiveUpdates:
+    """
+    Server-sent events for tracking updates, served by an asyncio server on
+    its own port from a daemon thread.
+
+    Every connection is a coroutine waiting on its own queue, so thousands of
+    idle subscribers cost a socket and a little memory each rather than a
+    WSGI thread. publish() may be called from any thread; each message is
+    encoded once and the same bytes are queued for every subscriber of its
+    channels. A subscriber whose queue fills up (a client not reading) is
+    disconnected, and the browser's EventSource reconnects on its own.
+
+    Streams:
+        /track/<batch_id>       updates of one product, public
+        /role/<role>?token=...  every update a role's dashboard shows; the
+                                token comes from role_token()
+
+    Events carry the TrackingHistory id as their SSE id. A reconnecting
+    client sends it back as Last-Event-ID and gets whatever it missed from
+    the last `replay` messages.
+    """
+
+    def __init__(self, broker, secret_key, host='0.0.0.0', port=8081, roles=(), token_max_age=43200,
+                 allow_origin='*', heartbeat=15, queue_size=64, replay=1000):
+        """
+        :param broker: LocalBroker, RedisBroker or compatible object
+        :param secret_key: Key role tokens are signed with
+        :param roles: Roles that may subscribe to a role stream
+        :param token_max_age: Seconds a role token stays valid
+        :param allow_origin: Access-Control-Allow-Origin of the streams, which
+                             are on a different port than the pages using them
+        :param heartbeat: Seconds between keep-alive comments
+        :param queue_size: Messages buffered per subscriber before it is dropped
+        :param replay: Recent messages kept for reconnecting clients
+        """
+        self.broker = broker
+        self.host = host
+        self.port = port
+        self.roles = set(roles)
+        self.token_max_age = token_max_age
+        self.allow_origin = allow_origin
+        self.heartbeat = heartbeat
+        self.queue_size = queue_size
+        self._serializer = URLSafeTimedSerializer(secret_key, salt='live-updates')
+        self._recent = deque(maxlen=replay)     # (event id, channels, encoded message)
+        self._subscribers = {}                  # channel -> {queue: task}
+        self._loop = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.connections = 0
+
+    # Publishing, from any thread
+
+    def start(self):
+        """
+        Starts the event loop thread and waits until the server is listening.
+        """
+        started = threading.Event()
+        failure = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self._serve(started))
+            except Exception as exc:
+                failure.append(exc)
+                started.set()
+
+        threading.Thread(target=run, name='live-updates', daemon=True).start()
+        started.wait()
+        if failure:
+            raise failure[0]
+        self.broker.listen(self._receive)
+
+    def publish(self, channels, event_id, data):
+        """
+        :param channels: Channel names, e.g. 'batch:<batch_id>' and 'role:<role>'
+        :param event_id: Increasing id of the event
+        :param data: JSON-serializable delta
+        """
+        self.broker.publish(list(channels), event_id, data)
+
+    def role_token(self, role, user_id):
+        """
+        :return: Signed token authorizing user_id to the stream of role
+        """
+        return self._serializer.dumps({'role': role, 'user_id': user_id})
+
+    def stats(self):
+        return {
+            'connections': self.connections,
+            'channels': len(self._subscribers),
+            'published': self.published,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+        }
+
+    def _receive(self, channels, event_id, data):
+        # Called on the broker's thread; fan out on the loop's
+        self._loop.call_soon_threadsafe(self._fan_out, channels, event_id, data)
+
+    # Event loop side
+
+    def _fan_out(self, channels, event_id, data):
+        message = f'id: {event_id}\nevent: status\ndata: {json.dumps(data, default=str)}\n\n'.encode()
+        self._recent.append((event_id, frozenset(channels), message))
+        self.published += 1
+        for channel in channels:
+            for queue, task in list(self._subscribers.get(channel, {}).items()):
+                try:
+                    queue.put_nowait(message)
+                    self.delivered += 1
+                except asyncio.QueueFull:
+                    self.dropped += 1
+                    task.cancel()
+
+    async def _serve(self, started):
+        reuse_port = hasattr(socket, 'SO_REUSEPORT')  # lets every worker process bind the same port
+        server = await asyncio.start_server(self._handle, self.host, self.port, reuse_port=reuse_port,
+                                            backlog=1024)
+        started.set()
+        async with server:
+            while True:
+                await asyncio.sleep(self.heartbeat)
+                for subscribers in list(self._subscribers.values()):
+                    for queue in subscribers:
+                        if not queue.full():
+                            queue.put_nowait(b': keep-alive\n\n')
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=10)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            request_line, *header_lines = head.decode('latin-1').split('\r\n')
+            method, target, _ = (request_line.split(' ') + ['', ''])[:3]
+            headers = {name.strip().lower(): value.strip()
+                       for name, _, value in (line.partition(':') for line in header_lines if line)}
+            if method != 'GET':
+                return await self._refuse(writer, '405 Method Not Allowed')
+            channel, status = self._channel(target)
+            if channel is None:
+                return await self._refuse(writer, status)
+            await self._stream(writer, channel, headers.get('last-event-id'))
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def _channel(self, target):
+        """
+        :return: (channel, None) for a valid stream, else (None, HTTP status)
+        """
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        if len(parts) == 2 and parts[0] == 'track' and parts[1]:
+            return f'batch:{parts[1]}', None
+        if len(parts) == 2 and parts[0] == 'role':
+            token = parse_qs(url.query).get('token', [''])[0]
+            try:
+                claims = self._serializer.loads(token, max_age=self.token_max_age)
+            except BadSignature:
+                return None, '403 Forbidden'
+            if parts[1] not in self.roles or claims.get('role') != parts[1]:
+                return None, '403 Forbidden'
+            return f'role:{parts[1]}', None
+        return None, '404 Not Found'
+
+    async def _refuse(self, writer, status):
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n'
+                     f'Access-Control-Allow-Origin: {self.allow_origin}\r\n\r\n'.encode())
+        await writer.drain()
+
+    async def _stream(self, writer, channel, last_event_id):
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers.setdefault(channel, {})[queue] = asyncio.current_task()
+        self.connections += 1
+        try:
+            writer.write(f'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                         f'Connection: keep-alive\r\nX-Accel-Buffering: no\r\n'
+                         f'Access-Control-Allow-Origin: {self.allow_origin}\r\n\r\nretry: 3000\n\n'.encode())
+            if last_event_id and last_event_id.isdigit():
+                # Replay what the client missed while it was reconnecting
+                for event_id, channels, message in list(self._recent):
+                    if event_id > int(last_event_id) and channel in channels:
+                        writer.write(message)
+            await writer.drain()
+            while True:
+                writer.write(await queue.get())
+                await writer.drain()
+        finally:
+            self.connections -= 1
+            subscribers = self._subscribers.get(channel, {})
+            subscribers.pop(queue, None)
+            if not subscribers:
+                self._subscribers.pop(channel, None)
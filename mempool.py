@@ -0,0 +1,144 @@
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import Future
+from time import monotonic
+
+# Where a submitted transaction ended up.
+Receipt = namedtuple('Receipt', ['block_index', 'tx_offset', 'block_hash'])
+
+_Pending = namedtuple('_Pending', ['transaction', 'future', 'submitted_at'])
+
+
+class Mempool:
+    """
+    Thread-safe buffer of pending transactions in front of a Blockchain.
+
+    submit() only appends to a lock-protected queue and returns a Future.
+    A background worker seals a block as soon as max_transactions are
+    pending or the oldest pending transaction has waited max_latency_ms,
+    mines it with Blockchain.mine_block and resolves every Future in the
+    block with a Receipt. metrics() reports the queue depth and how long
+    transactions take to reach the chain.
+    """
+
+    def __init__(self, blockchain, max_transactions=100, max_latency_ms=500):
+        """
+        :param blockchain: Blockchain to seal blocks into
+        :param max_transactions: Seal a block once this many transactions are pending
+        :param max_latency_ms: Seal a block once the oldest transaction is this old
+        """
+        self.blockchain = blockchain
+        self.max_transactions = max_transactions
+        self.max_latency = max_latency_ms / 1000
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._submitted = 0
+        self._sealed_blocks = 0
+        self._sealed_transactions = 0
+        self._failed_transactions = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        self._total_lag = 0.0
+        self._worker = threading.Thread(target=self._run, name='mempool-sealer', daemon=True)
+        self._worker.start()
+
+    def submit(self, sender, recipient, product_id, status):
+        """
+        Queues a transaction for the next block.
+        :return: Future resolving to the transaction's Receipt
+        """
+        transaction = self.blockchain.make_transaction(sender, recipient, product_id, status)
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Mempool is closed')
+            self._pending.append(_Pending(transaction, future, monotonic()))
+            self._submitted += 1
+            if len(self._pending) == 1 or len(self._pending) >= self.max_transactions:
+                self._condition.notify()
+        return future
+
+    def __len__(self):
+        with self._condition:
+            return len(self._pending)
+
+    def _next_batch(self):
+        """
+        Blocks until a block should be sealed and takes its transactions.
+        :return: List of pending entries, empty once closed and drained
+        """
+        with self._condition:
+            while True:
+                if self._pending:
+                    waited = monotonic() - self._pending[0].submitted_at
+                    if self._closed or len(self._pending) >= self.max_transactions or waited >= self.max_latency:
+                        count = min(len(self._pending), self.max_transactions)
+                        return [self._pending.popleft() for _ in range(count)]
+                    self._condition.wait(self.max_latency - waited)
+                elif self._closed:
+                    return []
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            self._seal(batch)
+
+    def _seal(self, batch):
+        try:
+            block = self.blockchain.mine_block([entry.transaction for entry in batch])
+            block_hash = self.blockchain.chain.hash_at(block['index'] - 1)
+        except Exception as exc:
+            with self._condition:
+                self._failed_transactions += len(batch)
+            for entry in batch:
+                entry.future.set_exception(exc)
+            return
+
+        sealed_at = monotonic()
+        with self._condition:
+            self._sealed_blocks += 1
+            self._sealed_transactions += len(batch)
+            for entry in batch:
+                lag = sealed_at - entry.submitted_at
+                self._total_lag += lag
+                self._max_lag = max(self._max_lag, lag)
+            self._last_lag = sealed_at - batch[-1].submitted_at
+        for offset, entry in enumerate(batch):
+            entry.future.set_result(Receipt(block['index'], offset, block_hash))
+
+    def metrics(self):
+        """
+        :return: Dictionary with the queue depth, throughput counters and the
+                 submit-to-sealed ledger lag in milliseconds
+        """
+        with self._condition:
+            oldest = monotonic() - self._pending[0].submitted_at if self._pending else 0.0
+            sealed = self._sealed_transactions
+            return {
+                'queue_depth': len(self._pending),
+                'oldest_pending_ms': round(oldest * 1000, 3),
+                'submitted': self._submitted,
+                'sealed_blocks': self._sealed_blocks,
+                'sealed_transactions': sealed,
+                'failed_transactions': self._failed_transactions,
+                'ledger_lag_ms': {
+                    'last': round(self._last_lag * 1000, 3),
+                    'avg': round(self._total_lag / sealed * 1000, 3) if sealed else 0.0,
+                    'max': round(self._max_lag * 1000, 3),
+                },
+            }
+
+    def close(self, timeout=None):
+        """
+        Stops accepting transactions, seals whatever is still pending and
+        waits for the worker to finish.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._worker.join(timeout)
@@ -0,0 +1,72 @@
+import hashlib
+
+from serialization import encode_transaction
+
+# Leaves and inner nodes are hashed with different prefixes so a leaf can
+# never be passed off as an inner node. An odd node at the end of a level is
+# promoted to the next level unchanged rather than paired with itself.
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def leaf_hash(transaction):
+    return hashlib.sha256(LEAF_PREFIX + encode_transaction(transaction)).digest()
+
+
+def _node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def _next_level(level):
+    paired = [_node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+    if len(level) % 2:
+        paired.append(level[-1])
+    return paired
+
+
+def merkle_root(transactions):
+    """
+    Computes the Merkle root over a block's transactions.
+    :param transactions: List of transactions
+    :return: SHA-256 hash string
+    """
+    level = [leaf_hash(transaction) for transaction in transactions]
+    if not level:
+        return hashlib.sha256(b'').hexdigest()
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0].hex()
+
+
+def merkle_proof(transactions, position):
+    """
+    Builds the inclusion proof for one transaction of a block.
+    :param transactions: List of transactions
+    :param position: Offset of the transaction in the list
+    :return: List of [side, sibling hash] pairs from the leaf up, where side
+             is 'left' or 'right' depending on where the sibling sits
+    """
+    level = [leaf_hash(transaction) for transaction in transactions]
+    proof = []
+    while len(level) > 1:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append(['left' if sibling < position else 'right', level[sibling].hex()])
+        level = _next_level(level)
+        position //= 2
+    return proof
+
+
+def verify_proof(transaction, proof, root):
+    """
+    Checks an inclusion proof produced by merkle_proof.
+    :param transaction: The transaction claimed to be in the block
+    :param proof: List of [side, sibling hash] pairs
+    :param root: Merkle root of the block
+    :return: True if the transaction is included, False otherwise
+    """
+    node = leaf_hash(transaction)
+    for side, sibling in proof:
+        sibling = bytes.fromhex(sibling)
+        node = _node_hash(sibling, node) if side == 'left' else _node_hash(node, sibling)
+    return node.hex() == root
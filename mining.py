@@ -0,0 +1,176 @@
+import hashlib
+import itertools
+import multiprocessing
+import os
+from time import perf_counter
+
+DEFAULT_DIFFICULTY = 4
+
+
+class MiningCancelled(Exception):
+    pass
+
+
+def target_for(difficulty):
+    """
+    Returns the digest bound for a difficulty: a SHA-256 digest below it
+    starts with `difficulty` hex zeroes.
+    :param difficulty: Number of leading hex zeroes, 1 to 64
+    :return: 32-byte target
+    """
+    if not 1 <= difficulty <= 64:
+        raise ValueError('difficulty must be between 1 and 64 hex digits')
+    return (1 << (256 - 4 * difficulty)).to_bytes(32, 'big')
+
+
+def valid_proof(last_proof, proof, difficulty=DEFAULT_DIFFICULTY):
+    """
+    Does hash(last_proof, proof) contain `difficulty` leading hex zeroes?
+    """
+    digest = hashlib.sha256(f'{last_proof}{proof}'.encode()).digest()
+    return digest < target_for(difficulty)
+
+
+def search(prefix, start, stop, target):
+    """
+    Scans nonces in [start, stop) for the first one whose hash is below target.
+    The SHA-256 state for the prefix is computed once and copied per nonce.
+    :param prefix: Encoded previous proof
+    :return: The nonce, or None if the range holds no valid proof
+    """
+    seeded = hashlib.sha256(prefix)
+    for nonce in range(start, stop):
+        candidate = seeded.copy()
+        candidate.update(b'%d' % nonce)
+        if candidate.digest() < target:
+            return nonce
+    return None
+
+
+_cancel_event = None
+
+
+def _init_worker(cancel_event):
+    global _cancel_event
+    _cancel_event = cancel_event
+
+
+def _search_batch(task):
+    prefix, start, stop, target = task
+    if _cancel_event.is_set():
+        return None
+    return search(prefix, start, stop, target)
+
+
+class ProofOfWorkEngine:
+    """
+    Finds proofs for Blockchain.proof_of_work.
+
+    The nonce space is cut into batches. With one worker the batches are
+    scanned in-process; otherwise they are spread over a persistent
+    multiprocessing pool. Results are consumed in batch order, so the engine
+    always returns the smallest valid nonce, exactly like a sequential search.
+    A running search can be stopped from another thread with cancel().
+    """
+
+    def __init__(self, difficulty=DEFAULT_DIFFICULTY, workers=1, batch_size=50000):
+        """
+        :param difficulty: Number of leading hex zeroes a proof hash needs
+        :param workers: Number of processes to mine with; None uses every core
+        :param batch_size: Nonces per batch, also the cancellation granularity
+        """
+        self.difficulty = difficulty
+        self.target = target_for(difficulty)
+        self.workers = workers or os.cpu_count()
+        self.batch_size = batch_size
+        self._cancel_event = multiprocessing.Event()
+        self._pool = None
+
+    def valid_proof(self, last_proof, proof):
+        return valid_proof(last_proof, proof, self.difficulty)
+
+    def mine(self, last_proof):
+        """
+        Searches for the smallest proof valid after last_proof.
+        :param last_proof: Previous proof
+        :return: New proof
+        :raises MiningCancelled: if cancel() was called before or during the search
+        """
+        prefix = str(last_proof).encode()
+        try:
+            if self.workers == 1:
+                return self._mine_inline(prefix)
+            return self._mine_parallel(prefix)
+        finally:
+            # Cleared once the search is over, so a cancel() issued before it started is not lost
+            self._cancel_event.clear()
+
+    def _mine_inline(self, prefix):
+        for start in itertools.count(0, self.batch_size):
+            if self._cancel_event.is_set():
+                raise MiningCancelled()
+            proof = search(prefix, start, start + self.batch_size, self.target)
+            if proof is not None:
+                return proof
+
+    def _mine_parallel(self, prefix):
+        pool = self._get_pool()
+        # Feed the pool a bounded wave of batches at a time; imap would
+        # otherwise drain an endless nonce iterator up front.
+        wave = self.workers * 4
+        for wave_start in itertools.count(0, wave * self.batch_size):
+            tasks = [(prefix, start, start + self.batch_size, self.target)
+                     for start in range(wave_start, wave_start + wave * self.batch_size, self.batch_size)]
+            for proof in pool.imap(_search_batch, tasks):
+                if proof is not None:
+                    return proof
+            if self._cancel_event.is_set():
+                raise MiningCancelled()
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers, initializer=_init_worker,
+                                              initargs=(self._cancel_event,))
+        return self._pool
+
+    def cancel(self):
+        """
+        Stops the running mine() call, or the next one if none is running;
+        it raises MiningCancelled.
+        """
+        self._cancel_event.set()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+def benchmark(workers=1, nonces=2000000):
+    """
+    Measures raw proof-of-work throughput.
+    :param workers: Number of processes to hash with
+    :param nonces: Number of hashes to compute
+    :return: Hashes per second
+    """
+    impossible = bytes(32)
+    batch_size = 50000
+    tasks = [(b'100', start, start + batch_size, impossible) for start in range(0, nonces, batch_size)]
+    started = perf_counter()
+    if workers == 1:
+        for task in tasks:
+            search(*task)
+    else:
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=(multiprocessing.Event(),)) as pool:
+            started = perf_counter()
+            list(pool.imap_unordered(_search_batch, tasks))
+    return len(tasks) * batch_size / (perf_counter() - started)
+
+
+if __name__ == "__main__":
+    cores = os.cpu_count()
+    print(f'1 core: {benchmark(1):,.0f} hashes/sec')
+    if cores > 1:
+        print(f'{cores} cores: {benchmark(cores, 2000000 * cores):,.0f} hashes/sec')
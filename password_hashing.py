@@ -0,0 +1,99 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingOverloaded(Exception):
+    """
+    Raised instead of queueing a hash that would wait too long; the caller
+    should answer 503 and let the client retry.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f'Password hashing is overloaded, retry in {retry_after}s')
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    Runs password hashing and verification on a small bounded thread pool.
+
+    hashlib releases the GIL while it runs PBKDF2 and scrypt, so the pool's
+    threads hash in parallel while request threads only wait on a Future.
+    The number of hashes running at once is capped by the pool size instead
+    of by however many requests arrive together. Admission is rate-aware:
+    from the average hash time and the work already queued, a new hash that
+    could not start within max_wait_ms, or that would exceed max_pending, is
+    rejected with HashingOverloaded rather than piling up behind the others.
+    """
+
+    def __init__(self, workers=2, method='pbkdf2:sha256', max_pending=64, max_wait_ms=2000):
+        """
+        :param workers: Hashes computed at the same time
+        :param method: werkzeug hash method and cost, e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1'
+        :param max_pending: Maximum hashes queued or running
+        :param max_wait_ms: Reject work expected to wait longer than this before it starts
+        """
+        self.workers = workers
+        self.method = method
+        self.max_pending = max_pending
+        self.max_wait = max_wait_ms / 1000
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._average = None   # exponential moving average of seconds per hash
+        self.completed = 0
+        self.rejected = 0
+
+    def hash(self, password):
+        """
+        :return: Hash of password with the configured method and cost
+        """
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """
+        :return: Whether password matches password_hash
+        """
+        return self._run(check_password_hash, password_hash, password)
+
+    def _run(self, function, *args):
+        self._admit()
+        try:
+            return self._executor.submit(self._timed, function, *args).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _admit(self):
+        with self._lock:
+            expected_wait = (self._pending // self.workers) * (self._average or 0)
+            if self._pending >= self.max_pending or expected_wait > self.max_wait:
+                self.rejected += 1
+                raise HashingOverloaded(retry_after=max(1, round(expected_wait)))
+            self._pending += 1
+
+    def _timed(self, function, *args):
+        started = perf_counter()
+        result = function(*args)
+        elapsed = perf_counter() - started
+        with self._lock:
+            self.completed += 1
+            self._average = elapsed if self._average is None else 0.9 * self._average + 0.1 * elapsed
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'method': self.method,
+                'pending': self._pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_hash_ms': round(self._average * 1000, 3) if self._average is not None else None,
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
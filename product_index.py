@@ -0,0 +1,105 @@
+import struct
+from collections import defaultdict
+
+
+class ProductIndex:
+    """
+    Secondary index over the blockchain: product_id -> [(block position, tx offset)].
+
+    With a path, every indexed block is also appended to an index file as
+    one record: block position, transaction count, then the product_id of
+    each transaction (the offset is implicit in the order). The file is
+    replayed on open and can always be rebuilt from the chain.
+    """
+
+    BLOCK_RECORD = struct.Struct('<QI')
+    STRING_LENGTH = struct.Struct('<H')
+
+    def __init__(self, path=None):
+        """
+        :param path: (Optional) Index file to persist to
+        """
+        self.path = path
+        self._entries = defaultdict(list)
+        self.indexed_blocks = 0
+        self._file = None
+        if path:
+            self._file = open(path, 'a+b')
+            self._load()
+
+    def _load(self):
+        self._file.seek(0)
+        data = self._file.read()
+        offset = 0
+        end = 0
+        try:
+            while offset < len(data):
+                position, count = self.BLOCK_RECORD.unpack_from(data, offset)
+                offset += self.BLOCK_RECORD.size
+                product_ids = []
+                for _ in range(count):
+                    (length,) = self.STRING_LENGTH.unpack_from(data, offset)
+                    offset += self.STRING_LENGTH.size
+                    if offset + length > len(data):
+                        raise struct.error('truncated record')
+                    product_ids.append(data[offset:offset + length].decode())
+                    offset += length
+                self._add(position, product_ids)
+                end = offset
+        except struct.error:
+            # A torn write at the tail: drop the partial record.
+            self._file.truncate(end)
+
+    def _add(self, position, product_ids):
+        for offset, product_id in enumerate(product_ids):
+            self._entries[product_id].append((position, offset))
+        self.indexed_blocks = position + 1
+
+    def add_block(self, position, transactions):
+        """
+        Indexes the transactions of a newly appended block.
+        :param position: Position of the block in the chain
+        :param transactions: List of transactions in the block
+        """
+        product_ids = [transaction['product_id'] for transaction in transactions]
+        if self._file is not None:
+            parts = [self.BLOCK_RECORD.pack(position, len(product_ids))]
+            for product_id in product_ids:
+                encoded = product_id.encode()
+                parts.append(self.STRING_LENGTH.pack(len(encoded)) + encoded)
+            self._file.write(b''.join(parts))
+            self._file.flush()
+        self._add(position, product_ids)
+
+    def catch_up(self, chain):
+        """
+        Indexes blocks appended to the chain after the index was last written.
+        :param chain: Block store or list of blocks
+        """
+        for position in range(self.indexed_blocks, len(chain)):
+            self.add_block(position, chain[position]['transactions'])
+
+    def rebuild(self, chain):
+        """
+        Discards the index and rebuilds it from the chain.
+        :param chain: Block store or list of blocks
+        """
+        self._entries.clear()
+        self.indexed_blocks = 0
+        if self._file is not None:
+            self._file.truncate(0)
+        self.catch_up(chain)
+
+    def get(self, product_id):
+        """
+        :return: List of (block position, tx offset) for a product, oldest first
+        """
+        return list(self._entries.get(product_id, ()))
+
+    def __contains__(self, product_id):
+        return product_id in self._entries
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
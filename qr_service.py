@@ -0,0 +1,133 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import qrcode
+import qrcode.image.svg
+
+# Bump when the rendering parameters change so cached images and ETags are
+# not reused across versions.
+RENDER_VERSION = 1
+
+MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+
+class QRCodeRenderer:
+    """
+    Renders QR codes on demand with a bounded in-memory LRU cache and an
+    optional on-disk cache.
+
+    Images are addressed by the hash of what they encode, so the same key is
+    used for the disk file name and the HTTP ETag, and an ETag can be checked
+    without rendering anything.
+    """
+
+    def __init__(self, cache_size=1024, cache_dir=None):
+        """
+        :param cache_size: Maximum number of images kept in memory
+        :param cache_dir: (Optional) Directory for the content-addressed disk cache
+        """
+        self.cache_size = cache_size
+        self.cache_dir = cache_dir
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(data, fmt):
+        """
+        :return: Content address of the image encoding data in the given format
+        """
+        return hashlib.sha256(f'{RENDER_VERSION}:{fmt}:{data}'.encode()).hexdigest()
+
+    def _disk_path(self, key, fmt):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.{fmt}')
+
+    def get(self, data, fmt):
+        """
+        Looks an image up in memory, then on disk, without rendering it.
+        :return: Image bytes, or None on a miss
+        """
+        key = self.key(data, fmt)
+        with self._lock:
+            image = self._cache.get(key)
+            if image is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return image
+        if self.cache_dir:
+            try:
+                with open(self._disk_path(key, fmt), 'rb') as f:
+                    image = f.read()
+            except FileNotFoundError:
+                return None
+            self._remember(key, image)
+            with self._lock:
+                self.disk_hits += 1
+            return image
+        return None
+
+    def render(self, data, fmt='png'):
+        """
+        Returns the image for data, rendering and caching it on a miss.
+        :param data: Text to encode
+        :param fmt: 'png' or 'svg'
+        :return: Image bytes
+        """
+        image = self.get(data, fmt)
+        if image is not None:
+            return image
+        with self._lock:
+            self.misses += 1
+        image = self._render(data, fmt)
+        key = self.key(data, fmt)
+        self._remember(key, image)
+        if self.cache_dir:
+            self._write_disk(key, fmt, image)
+        return image
+
+    def _remember(self, key, image):
+        with self._lock:
+            self._cache[key] = image
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _write_disk(self, key, fmt, image):
+        path = self._disk_path(key, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique across the threads and the bulk-create worker processes writing this directory
+        temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(image)
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def _render(data, fmt):
+        qr = qrcode.QRCode(
+            version=1,
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            box_size=10,
+            border=4,
+        )
+        qr.add_data(data)
+        qr.make(fit=True)
+        buffer = io.BytesIO()
+        if fmt == 'svg':
+            qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+        else:
+            qr.make_image(fill_color="black", back_color="white").save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._cache),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,184 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class LRUCacheBackend:
+    """
+    In-process cache backend: a bounded LRU with optional per-entry TTL.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, monotonic() + ttl if ttl else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """
+    Cache backend on any client with the redis-py get/set/delete interface,
+    shared by every worker process so invalidations reach all of them.
+    """
+
+    def __init__(self, client, prefix='track:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis  # optional dependency, only needed for this backend
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class Invalidations:
+    """
+    Remembers when each key was last invalidated, so a value computed from
+    data read before an invalidation is not stored after it.
+
+    A filler takes generation() before reading the data and stores the value
+    with store(), which drops it if the key was invalidated since. Only the
+    latest max_keys invalidations are remembered; a generation older than
+    all of them counts as invalidated.
+    """
+
+    def __init__(self, max_keys=4096):
+        self.max_keys = max_keys
+        self._generation = 0
+        self._invalidated = OrderedDict()   # key -> generation of its last invalidation, oldest first
+        self._lock = threading.Lock()
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def invalidate(self, key, delete):
+        """
+        :param delete: Callable removing key from the cache, run under the lock
+        """
+        with self._lock:
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            if len(self._invalidated) > self.max_keys:
+                self._invalidated.popitem(last=False)
+            delete(key)
+
+    def store(self, key, generation, store):
+        """
+        Runs store() unless key was invalidated after generation.
+        :return: True if the value was stored
+        """
+        with self._lock:
+            invalidated = self._invalidated.get(key)
+            if invalidated is None and len(self._invalidated) >= self.max_keys:
+                # key may have been forgotten; assume the worst
+                invalidated = next(iter(self._invalidated.values()))
+            if invalidated is not None and invalidated > generation:
+                return False
+            store()
+            return True
+
+
+class ResponseCache:
+    """
+    Caches rendered response bodies with their ETag on a pluggable backend
+    and counts hits, misses and invalidations.
+
+    To keep a render that raced with an update from caching the old page,
+    take generation() before reading the data and pass it to set(). This
+    covers invalidations made by this process; those of other processes
+    sharing a Redis backend are bounded by the TTL.
+    """
+
+    def __init__(self, backend, ttl=None):
+        """
+        :param backend: LRUCacheBackend, RedisCacheBackend or compatible object
+        :param ttl: (Optional) Seconds an entry may live, bounding staleness when
+                    invalidations cannot reach every process
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.discarded = 0
+        self._lock = threading.Lock()
+        self._invalidations = Invalidations()
+
+    def generation(self):
+        return self._invalidations.generation()
+
+    def get(self, key):
+        """
+        :return: (etag, body) or None on a miss
+        """
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        etag, _, body = value.partition(b'\n')
+        return etag.decode(), body
+
+    def set(self, key, etag, body, generation):
+        """
+        :param generation: generation() taken before the body was rendered;
+                           the body is dropped if key was invalidated since
+        """
+        value = etag.encode() + b'\n' + body
+        if not self._invalidations.store(key, generation, lambda: self.backend.set(key, value, self.ttl)):
+            with self._lock:
+                self.discarded += 1
+
+    def invalidate(self, key):
+        self._invalidations.invalidate(key, self.backend.delete)
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'invalidations': self.invalidations,
+                'discarded': self.discarded,
+            }
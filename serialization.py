@@ -0,0 +1,124 @@
+import struct
+
+# Canonical binary encoding of blocks and transactions, used for hashing and
+# for the block store. Blocks are hashed as encode_header(block), which
+# commits to the transactions through the Merkle root, so any change to this
+# layout must bump FORMAT_VERSION.
+#
+# Header:      version u8 | index u64 | proof u64 | timestamp | previous_hash |
+#              merkle_root
+# Block:       header | transaction count u32 | transactions
+# Transaction: sender | recipient | product_id | status | timestamp
+# Strings are UTF-8 prefixed with their byte length as u16.
+#
+# Format 1 had no merkle_root and hashed the whole block. Such blocks can
+# still be decoded and encoded, so block stores written with it can be
+# verified and migrated.
+
+FORMAT_VERSION = 2
+PRE_MERKLE_FORMAT_VERSION = 1
+
+BLOCK_HEADER = struct.Struct('<BQQ')
+COUNT = struct.Struct('<I')
+STRING_LENGTH = struct.Struct('<H')
+
+TRANSACTION_FIELDS = ('sender', 'recipient', 'product_id', 'status', 'timestamp')
+
+
+def _pack_string(value):
+    data = str(value).encode()
+    return STRING_LENGTH.pack(len(data)) + data
+
+
+def _unpack_string(data, offset):
+    (length,) = STRING_LENGTH.unpack_from(data, offset)
+    offset += STRING_LENGTH.size
+    return data[offset:offset + length].decode(), offset + length
+
+
+def encode_transaction(transaction):
+    """
+    Encodes a transaction dictionary.
+    :param transaction: Transaction
+    :return: bytes
+    """
+    return b''.join([_pack_string(transaction[field]) for field in TRANSACTION_FIELDS])
+
+
+def encode_header(block):
+    """
+    Encodes the fields of a block dictionary that its hash covers.
+    :param block: Block
+    :return: bytes
+    """
+    return b''.join([
+        BLOCK_HEADER.pack(FORMAT_VERSION, block['index'], block['proof']),
+        _pack_string(block['timestamp']),
+        _pack_string(block['previous_hash']),
+        _pack_string(block['merkle_root']),
+    ])
+
+
+def encode_block(block):
+    """
+    Encodes a block dictionary, including its transactions.
+    :param block: Block
+    :return: bytes
+    """
+    parts = [encode_header(block), COUNT.pack(len(block['transactions']))]
+    parts.extend(encode_transaction(transaction) for transaction in block['transactions'])
+    return b''.join(parts)
+
+
+def encode_pre_merkle_block(block):
+    """
+    Encodes a block dictionary in format 1, whose hash covered these bytes.
+    :param block: Block
+    :return: bytes
+    """
+    parts = [
+        BLOCK_HEADER.pack(PRE_MERKLE_FORMAT_VERSION, block['index'], block['proof']),
+        _pack_string(block['timestamp']),
+        _pack_string(block['previous_hash']),
+        COUNT.pack(len(block['transactions'])),
+    ]
+    parts.extend(encode_transaction(transaction) for transaction in block['transactions'])
+    return b''.join(parts)
+
+
+def decode_block(data):
+    """
+    Decodes bytes produced by encode_block back into a block dictionary.
+    Format 1 blocks decode without a merkle_root.
+    :param data: bytes-like object
+    :return: Block
+    """
+    version, index, proof = BLOCK_HEADER.unpack_from(data, 0)
+    if version not in (FORMAT_VERSION, PRE_MERKLE_FORMAT_VERSION):
+        raise ValueError(f'Unsupported block format version {version}')
+    offset = BLOCK_HEADER.size
+    timestamp, offset = _unpack_string(data, offset)
+    previous_hash, offset = _unpack_string(data, offset)
+    merkle_root = None
+    if version == FORMAT_VERSION:
+        merkle_root, offset = _unpack_string(data, offset)
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+
+    transactions = []
+    for _ in range(count):
+        transaction = {}
+        for field in TRANSACTION_FIELDS:
+            transaction[field], offset = _unpack_string(data, offset)
+        transactions.append(transaction)
+
+    block = {
+        'index': index,
+        'timestamp': timestamp,
+        'transactions': transactions,
+        'proof': proof,
+        'previous_hash': previous_hash,
+    }
+    if merkle_root is not None:
+        block['merkle_root'] = merkle_root
+    return block
@@ -0,0 +1,52 @@
+import csv
+import io
+import json
+
+from flask import Response, stream_with_context
+
+# Encoded rows are buffered up to this many characters per response chunk
+CHUNK_SIZE = 64 * 1024
+
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def encode_rows(columns, rows, fmt):
+    """
+    Encodes rows as CSV (with a header line) or newline-delimited JSON,
+    yielding chunks of about CHUNK_SIZE characters. Only the current chunk is
+    held in memory, however many rows there are.
+    :param columns: Column names, in row order
+    :param rows: Iterable of sequences with one value per column
+    :param fmt: 'csv' or 'ndjson'
+    :return: Generator of str chunks
+    """
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(json.dumps(dict(zip(columns, row)), default=str))
+            buffer.write('\n')
+
+    for row in rows:
+        write(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_response(columns, rows, fmt, filename):
+    """
+    Chunked download of encode_rows(). The generator runs while the response
+    is sent, inside the request context, so rows can come straight from a
+    database cursor opened by the view.
+    :param filename: Download name without extension
+    :return: Response
+    """
+    return Response(stream_with_context(encode_rows(columns, rows, fmt)), mimetype=MIMETYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'})
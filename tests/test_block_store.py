@@ -0,0 +1,54 @@
+"""
+A BlockStore is appended to by the ledger's sealer thread while request
+threads read it; reads that find the map too short remap it, which must not
+close the map under another reader.
+"""
+import hashlib
+import os
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from block_store import BlockStore  # noqa: E402
+
+
+def make_block(index):
+    transactions = [{'sender': 'Manufacturer', 'recipient': 'Distributor', 'product_id': str(index),
+                     'status': 'Shipped', 'timestamp': '2024-01-01 00:00:00'}]
+    return {'index': index, 'timestamp': '2024-01-01 00:00:00', 'transactions': transactions, 'proof': index,
+            'previous_hash': '0' * 64, 'merkle_root': '0' * 64}
+
+
+def test_reads_while_appending(tmp_path):
+    store = BlockStore(str(tmp_path / 'ledger'))
+    store.append(make_block(1), hashlib.sha256(b'1').hexdigest())
+    appending = True
+    errors = []
+
+    def read():
+        while appending:
+            try:
+                length = len(store)
+                for position in (0, length // 2, length - 1):
+                    assert store[position]['index'] == position + 1
+                    store.hash_at(position)
+                assert store[-1]['index'] >= length
+                for block, _ in store.items(max(0, length - 10), length):
+                    assert block['transactions'][0]['product_id'] == str(block['index'])
+            except Exception as exc:  # noqa: BLE001 - every failure is reported below
+                errors.append(exc)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        for index in range(2, 3001):
+            store.append(make_block(index), hashlib.sha256(str(index).encode()).hexdigest())
+    finally:
+        appending = False
+        for reader in readers:
+            reader.join()
+        store.close()
+    assert not errors, errors[:3]
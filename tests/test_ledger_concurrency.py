@@ -0,0 +1,52 @@
+"""
+Request threads read the ledger (inclusion proofs, a product's transactions,
+the ledger export) while the mempool's sealer thread appends blocks to it.
+"""
+import os
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from blockchain import Blockchain  # noqa: E402
+from mempool import Mempool  # noqa: E402
+
+
+def test_proofs_and_exports_while_blocks_are_sealed(tmp_path):
+    blockchain = Blockchain(storage_path=str(tmp_path / 'ledger'), difficulty=1)
+    ledger = Mempool(blockchain, max_transactions=2, max_latency_ms=1)
+    products = [f'batch-{number}' for number in range(20)]
+    sealing = True
+    errors = []
+
+    def read():
+        while sealing:
+            try:
+                for product_id in products:
+                    proof = blockchain.prove_transaction(product_id, 'Shipped')
+                    if proof is not None:
+                        assert Blockchain.verify_transaction_proof(proof)
+                    for transaction in blockchain.transactions_for(product_id):
+                        assert transaction['product_id'] == product_id
+                for position, block in enumerate(blockchain.get_blockchain_data()):
+                    assert block['index'] == position + 1
+            except Exception as exc:  # noqa: BLE001 - every failure is reported below
+                errors.append(exc)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        futures = [ledger.submit('Manufacturer', 'Distributor', product_id, status)
+                   for status in ('Shipped', 'In Transit', 'Delivered') * 40 for product_id in products]
+        for future in futures:
+            future.result(timeout=60)
+        assert blockchain.validate_chain()
+    finally:
+        sealing = False
+        for reader in readers:
+            reader.join()
+        ledger.close()
+        blockchain.close()
+    assert not errors, errors[:3]
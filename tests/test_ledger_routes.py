@@ -0,0 +1,74 @@
+"""
+/track/<batch_id>/proof and /export/ledger.* read the ledger from request
+threads while the mempool's sealer thread appends blocks to it.
+"""
+import os
+import sys
+import tempfile
+import threading
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='mediledger-test-')
+# app.py reads its settings at import time
+os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(WORKDIR, 'test.db')}",
+                  LEDGER_PATH=os.path.join(WORKDIR, 'ledger'), LEDGER_DIFFICULTY='1',
+                  LEDGER_BLOCK_SIZE='2', LEDGER_BLOCK_INTERVAL_MS='1',
+                  INSTRUMENTATION='0', LIVE_UPDATES='0')
+sys.path.insert(0, ROOT)
+
+import app as tracking  # noqa: E402
+
+
+def test_proofs_and_ledger_export_while_blocks_are_sealed():
+    with tracking.app.app_context():
+        manufacturer = tracking.User(username='ledger-manufacturer', email='ledger-manufacturer@test', password='-',
+                                     role='manufacturer')
+        tracking.db.session.add(manufacturer)
+        tracking.db.session.flush()
+        batch_ids = [str(uuid.uuid4()) for _ in range(10)]
+        for batch_id in batch_ids:
+            product = tracking.Product(name='Product', batch_id=batch_id, qr_code_path=f'qr/{batch_id}.png',
+                                       manufacturer_id=manufacturer.id)
+            tracking.db.session.add(product)
+            tracking.db.session.flush()
+            tracking.db.session.add(tracking.TrackingHistory(product_id=product.id, status='Shipped',
+                                                             updated_by=manufacturer.id))
+        tracking.db.session.commit()
+        manufacturer_id = manufacturer.id
+
+    ledger = tracking.get_ledger()
+    sealing = True
+    errors = []
+
+    def read():
+        client = tracking.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(manufacturer_id)
+        while sealing:
+            try:
+                for batch_id in batch_ids:
+                    status = client.get(f'/track/{batch_id}/proof').status_code
+                    if status not in (200, 404):
+                        errors.append(f'proof of {batch_id}: {status}')
+                response = client.get('/export/ledger.ndjson')
+                response.get_data()
+                if response.status_code != 200:
+                    errors.append(f'ledger export: {response.status_code}')
+            except Exception as exc:  # noqa: BLE001 - streamed responses fail while being read
+                errors.append(exc)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        futures = [ledger.submit('ledger-manufacturer', 'Distributor', batch_id, 'Shipped')
+                   for _ in range(30) for batch_id in batch_ids]
+        for future in futures:
+            future.result(timeout=60)
+    finally:
+        sealing = False
+        for reader in readers:
+            reader.join()
+    assert not errors, errors[:3]
+    assert tracking.app.test_client().get(f'/track/{batch_ids[0]}/proof').status_code == 200
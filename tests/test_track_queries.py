@@ -0,0 +1,78 @@
+"""
+/track/<batch_id> must run the same number of SQL statements however long a
+product's history is: the product, its manufacturer and the history with the
+users who updated it are each loaded in one query.
+"""
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='mediledger-test-')
+# app.py reads its settings at import time
+os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(WORKDIR, 'test.db')}",
+                  LEDGER_PATH=os.path.join(WORKDIR, 'ledger'),
+                  INSTRUMENTATION='0', LIVE_UPDATES='0')
+sys.path.insert(0, ROOT)
+
+import app as tracking  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def products():
+    """
+    One product per history length, keyed by the number of history rows.
+    """
+    with tracking.app.app_context():
+        manufacturer = tracking.User(username='manufacturer', email='manufacturer@test', password='-',
+                                     role='manufacturer')
+        distributor = tracking.User(username='distributor', email='distributor@test', password='-',
+                                    role='distributor')
+        tracking.db.session.add_all([manufacturer, distributor])
+        tracking.db.session.flush()
+        batch_ids = {}
+        base = datetime(2024, 1, 1)
+        for length in (0, 1, 50):
+            batch_id = str(uuid.uuid4())
+            product = tracking.Product(name=f'Product {length}', batch_id=batch_id, qr_code_path=f'qr/{batch_id}.png',
+                                       manufacturer_id=manufacturer.id)
+            tracking.db.session.add(product)
+            tracking.db.session.flush()
+            tracking.db.session.add_all([
+                tracking.TrackingHistory(product_id=product.id, status='In Transit', updated_by=distributor.id,
+                                         timestamp=base + timedelta(minutes=minute))
+                for minute in range(length)])
+            batch_ids[length] = batch_id
+        tracking.db.session.commit()
+    return batch_ids
+
+
+def count_queries(path):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with tracking.app.app_context():
+        engine = tracking.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = tracking.app.test_client().get(path)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert response.status_code == 200
+    return len(statements)
+
+
+def test_track_query_count_is_independent_of_history_length(products):
+    # Every page must be rendered, not served from the page cache
+    for batch_id in products.values():
+        tracking.track_cache.invalidate(batch_id)
+    counts = {length: count_queries(f'/track/{batch_id}') for length, batch_id in products.items()}
+    assert counts[0] > 0
+    assert counts[0] == counts[1] == counts[50], counts